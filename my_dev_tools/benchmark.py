@@ -0,0 +1,486 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import statistics
+import time
+import tracemalloc
+from typing import Any, Callable, Coroutine
+
+from bs4 import BeautifulSoup
+
+from . import config
+from .browser import Browser, Transport
+from .browser_dom import PageNode
+from .browser_page import WaitState
+from .chunker import chunk_text, prefetch_chunks
+from .fake_devtools import FakeDevTools
+from .html_parse import available_parsers, paragraphs_text, parse_html, parse_html_async
+from .tokenizer import TokenCountMode, TokenizerService
+
+DEFAULT_ROUNDS = 20
+TRACEBACK_DEPTHS = (4, 8, 16, 30)
+QUERY_TIMEOUT = 2
+XPATH_CASES = ('//*[@id="prompt-textarea"]', '//main//div[contains(@class, "text-token-text-primary")]', '//section/p')
+WAIT_MUTATION_DELAY = .05
+SET_PROPS_NODES = 20
+NODE_MEMORY_COUNT = 10000
+SYNTHETIC_ARTICLE_PARAGRAPHS = (50, 800)
+CHUNK_TOKEN_LIMIT = 1024
+# 模拟 continue_ask_and_wait 等待回答的耗时
+CHUNK_ASK_DELAY = .02
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+# 与 XPATH_CASES 一一对应的 CSS 选择器
+CSS_CASES = ('#prompt-textarea', 'main div[class*="text-token-text-primary"]', 'section > p')
+
+
+def _stats(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        'rounds': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': samples[len(samples) // 2] * 1000,
+        'p95_ms': samples[min(len(samples) - 1, int(len(samples) * .95))] * 1000,
+        'min_ms': samples[0] * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+async def _measure(func: Callable[[], Coroutine[Any, Any, Any]], rounds: int) -> dict:
+    samples = list[float]()
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - start)
+    return _stats(samples)
+
+
+async def bench_xpath_query(browser: Browser, rounds: int) -> dict:
+    page = browser.find_page_by_url_prefix('https://chat.openai.com')
+    results = dict()
+    for xpath in XPATH_CASES:
+        results[xpath] = await _measure(lambda: page.query_nodes_by_xpath(xpath, QUERY_TIMEOUT), rounds)
+    return results
+
+
+async def bench_css_query(browser: Browser, rounds: int) -> dict:
+    page = browser.find_page_by_url_prefix('https://chat.openai.com')
+    results = dict()
+    for selector in CSS_CASES:
+        results[selector] = await _measure(lambda: page.query_nodes_by_css(selector, QUERY_TIMEOUT), rounds)
+    for selector in CSS_CASES:
+        # DOM.querySelectorAll + 批量 describeNode
+        results[f'{selector} (dom)'] = await _measure(
+            lambda: page.query_nodes_by_css(selector, QUERY_TIMEOUT, with_pseudo=True), rounds)
+    return results
+
+
+async def bench_snapshot_query(browser: Browser, rounds: int) -> dict:
+    page = browser.find_page_by_url_prefix('https://chat.openai.com')
+    snapshot = await page.capture_snapshot()
+    results = {'capture': await _measure(page.capture_snapshot, rounds)}
+    for xpath in XPATH_CASES:
+        async def _query():
+            snapshot.query_xpath(xpath)
+
+        results[xpath] = await _measure(_query, rounds)
+    return results
+
+
+async def bench_traceback_node(browser: Browser, rounds: int, max_depth: int) -> dict:
+    page = browser.find_page_by_url_prefix('https://chat.openai.com')
+    results = dict()
+    for depth in [x for x in TRACEBACK_DEPTHS if x < max_depth]:
+        async def _traceback():
+            node = await page.require_single_node_by_xpath(f'//div[@data-depth="{depth}"]', QUERY_TIMEOUT)
+            await node.traceback_node()
+
+        results[f'depth={depth}'] = await _measure(_traceback, rounds)
+    return results
+
+
+async def bench_text_content(browser: Browser, rounds: int) -> dict:
+    page = browser.find_page_by_url_prefix('https://chat.openai.com')
+    node = await page.require_single_node_by_xpath('//*[@id="js_content"]', QUERY_TIMEOUT)
+
+    async def _outer_html_text():
+        node.invalidate_content()
+        BeautifulSoup(await node.outer_html, 'html.parser').get_text()
+
+    async def _in_page_text():
+        node.invalidate_content()
+        await node.text_content
+
+    async def _cached_text():
+        await node.text_content
+
+    return {'outer_html+bs4': await _measure(_outer_html_text, rounds),
+            'in_page': await _measure(_in_page_text, rounds),
+            'cached': await _measure(_cached_text, rounds)}
+
+
+async def bench_set_props(browser: Browser, rounds: int) -> dict:
+    page = browser.find_page_by_url_prefix('https://chat.openai.com')
+    nodes = (await page.query_nodes_by_css('div.row', QUERY_TIMEOUT))[:SET_PROPS_NODES]
+    props = {'data-tag': 'bench', 'data-round': '0'}
+
+    async def _per_attribute():
+        # 原实现: 每个属性一次 DOM.setAttributeValue, 之后 describeNode 刷新
+        for node in nodes:
+            await node._ensure_node_id()
+            for name, value in props.items():
+                await page.command_result('DOM.setAttributeValue', QUERY_TIMEOUT,
+                                          nodeId=node._node_id, name=name, value=value)
+            await node.update_node()
+
+    return {f'per_attribute x{len(nodes)}': await _measure(_per_attribute, max(1, rounds // 10)),
+            f'set_nodes_props x{len(nodes)}': await _measure(lambda: page.set_nodes_props(nodes, props), rounds)}
+
+
+class _EagerPageNode:
+    # 改为 __slots__ 懒解析之前的 PageNode 布局, 仅用于内存对比
+    def __init__(self, page, x_path: str, **kwargs):
+        self.page = page
+        self.x_path = x_path
+        self.backend_id = kwargs['backendNodeId']
+        self.name = kwargs['localName']
+        self.child_count = kwargs['childNodeCount']
+        flatter_attrs = kwargs['attributes']
+        self._attributes = {flatter_attrs[i]: flatter_attrs[i + 1] for i in range(0, len(flatter_attrs), 2)}
+        self._pseudo_type = kwargs.get('pseudoType')
+        self.pseudo_nodes = [_EagerPageNode(page, '', **x) for x in kwargs.get('pseudoElements', [])]
+
+
+def _answer_node_payloads(count: int) -> list[dict]:
+    # 回答中的 <p>/<li>/<code> 节点, 一半带 ::before 伪元素
+    payloads = list[dict]()
+    for i in range(count):
+        name = ('p', 'li', 'code')[i % 3]
+        data = {'nodeId': i + 1, 'backendNodeId': i + 100001, 'nodeType': 1, 'nodeName': name.upper(),
+                'localName': name, 'nodeValue': '', 'childNodeCount': 1,
+                'attributes': ['class', 'whitespace-pre-wrap break-words', 'data-index', str(i)]}
+        if i % 2:
+            data['pseudoElements'] = [{'nodeId': 0, 'backendNodeId': i + 500001, 'nodeType': 1,
+                                       'nodeName': '::before', 'localName': '', 'nodeValue': '',
+                                       'childNodeCount': 0, 'attributes': [], 'pseudoType': 'before'}]
+        payloads.append(data)
+    return payloads
+
+
+def bench_node_memory(browser: Browser, count=NODE_MEMORY_COUNT) -> dict:
+    # 只统计节点对象本身的内存, describe 的原始结果在两种布局下都存在, 不计入
+    page = browser.find_page_by_url_prefix('https://chat.openai.com')
+    payloads = _answer_node_payloads(count)
+
+    def _build(factory: Callable[[dict], Any], touch: Callable[[Any], Any] = None) -> dict:
+        tracemalloc.start()
+        start = time.perf_counter()
+        nodes = [factory(x) for x in payloads]
+        if touch:
+            for node in nodes:
+                touch(node)
+        elapsed = time.perf_counter() - start
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {'nodes': len(nodes), 'bytes_per_node': size / len(nodes), 'build_ms': elapsed * 1000}
+
+    return {'eager': _build(lambda x: _EagerPageNode(page, '', **x)),
+            'slots_lazy': _build(lambda x: PageNode(page, '', x)),
+            'slots_backend_id': _build(lambda x: PageNode(page, '', x), lambda x: x.backend_id),
+            'slots_materialized': _build(lambda x: PageNode(page, '', x), lambda x: (x._attributes, x.pseudo_nodes))}
+
+
+def _synthetic_article(paragraphs: int) -> str:
+    # 公众号文章的典型结构: 每段 section 内嵌 p/span/strong, 间或插图
+    parts = ['<div id="js_content">']
+    for i in range(paragraphs):
+        parts.append(f'<section style="margin: 8px 0"><p><span style="font-size: 15px">第 {i} 段. '
+                     f'{"这是用于解析基准测试的正文内容, " * 6}</span><strong>重点 {i}</strong></p></section>')
+        if i % 10 == 0:
+            parts.append(f'<section><img data-src="https://example.com/{i}.png" style="width: 100%"></section>')
+    parts.append('</div>')
+    return ''.join(parts)
+
+
+def _article_fixtures() -> dict[str, str]:
+    # 优先使用 DATA_DIR 下保存的文章 HTML, 没有时生成不同规模的合成文章
+    fixtures = dict[str, str]()
+    for path in sorted(glob.glob(os.path.join(config.article_fixture_dir(), '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            fixtures[os.path.basename(path)] = f.read()
+    if not fixtures:
+        fixtures = {f'synthetic_{x}p': _synthetic_article(x) for x in SYNTHETIC_ARTICLE_PARAGRAPHS}
+    return fixtures
+
+
+async def _max_loop_stall(func: Callable[[], Coroutine[Any, Any, Any]]) -> float:
+    # func 执行期间事件循环最长一次无法调度的时间
+    stall = 0.
+    running = True
+
+    async def _ticker():
+        nonlocal stall
+        last = time.perf_counter()
+        while running:
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+            stall = max(stall, now - last)
+            last = now
+
+    ticker = asyncio.ensure_future(_ticker())
+    await asyncio.sleep(0)
+    try:
+        await func()
+    finally:
+        running = False
+        await ticker
+    return stall
+
+
+async def bench_html_parse(rounds: int) -> dict:
+    # extract_weixin_article 按 section 与 p 各取一次段落: 原实现解析两次, 缓存后解析一次
+    results = dict()
+    for name, html in _article_fixtures().items():
+        label = f'{name} ({len(html) // 1024}KB)'
+        for parser in available_parsers():
+            async def _reparse():
+                paragraphs_text(parse_html(html, parser), 'section')
+                paragraphs_text(parse_html(html, parser), 'p')
+
+            async def _cached():
+                soup = parse_html(html, parser)
+                paragraphs_text(soup, 'section')
+                paragraphs_text(soup, 'p')
+
+            results[f'{label} {parser} reparse'] = await _measure(_reparse, rounds)
+            results[f'{label} {parser} cached'] = await _measure(_cached, rounds)
+
+        async def _parse_inline():
+            parse_html(html)
+
+        async def _parse_async():
+            await parse_html_async(html)
+
+        for case, func in [('stall inline', _parse_inline), ('stall parse_html_async', _parse_async)]:
+            results[f'{label} {case}'] = _stats([await _max_loop_stall(func) for _ in range(max(1, rounds // 4))])
+    return results
+
+
+async def bench_actions(browser: Browser, rounds: int) -> dict:
+    page = browser.find_page_by_url_prefix('https://chat.openai.com')
+    node = await page.require_single_node_by_css('#prompt-textarea', QUERY_TIMEOUT)
+
+    async def _sequential_click():
+        # 原 left_click 之前的逐条往返
+        await page.command_result('DOM.scrollIntoViewIfNeeded', QUERY_TIMEOUT, backendNodeId=node.backend_id)
+        result = await page.command_result('DOM.getContentQuads', QUERY_TIMEOUT, backendNodeId=node.backend_id)
+        x, y = sum(result['quads'][0][0::2]) / 4, sum(result['quads'][0][1::2]) / 4
+        for mouse_type in ['mousePressed', 'mouseReleased']:
+            await page.command_result('Input.dispatchMouseEvent', QUERY_TIMEOUT,
+                                      type=mouse_type, x=x, y=y, button='left')
+
+    async def _sequential_submit():
+        await page.command_result('DOM.focus', QUERY_TIMEOUT, backendNodeId=node.backend_id)
+        await page.command_result('Runtime.callFunctionOn', QUERY_TIMEOUT,
+                                  functionDeclaration='function() {this.value = ""}', objectId=await node.object_id)
+        await page.command_result('Input.insertText', QUERY_TIMEOUT, text='hello')
+        await node.trigger_entry_key()
+
+    return {'click (sequential)': await _measure(_sequential_click, rounds),
+            'click': await _measure(node.click, rounds),
+            'hover': await _measure(node.hover, rounds),
+            'type_and_submit (sequential)': await _measure(_sequential_submit, rounds),
+            'type_and_submit': await _measure(lambda: node.type_and_submit('hello'), rounds)}
+
+
+def _token_corpus() -> dict[str, list[str]]:
+    templates = list[str]()
+    for path in sorted(glob.glob(os.path.join(TEMPLATE_DIR, '*.json'))):
+        with open(path, encoding='utf-8') as f:
+            templates.append(json.load(f)['template'])
+    articles = [parse_html(x).get_text() for x in _article_fixtures().values()]
+    return {'templates': templates, 'articles': articles}
+
+
+async def bench_token_count(rounds: int) -> dict:
+    results = dict()
+    for name, texts in _token_corpus().items():
+        label = f'{name} x{len(texts)}'
+        # cache_size=0: 每轮都真实编码, 不测缓存命中
+        service = TokenizerService(cache_size=0)
+        estimated = service.count_tokens(texts, TokenCountMode.ESTIMATE)
+
+        async def _estimate():
+            service.count_tokens(texts, TokenCountMode.ESTIMATE)
+
+        async def _exact():
+            service.count_tokens(texts, TokenCountMode.EXACT)
+
+        results[f'{label} estimate'] = await _measure(_estimate, rounds)
+        try:
+            exact = service.count_tokens(texts, TokenCountMode.EXACT)
+        except ImportError as e:
+            results[f'{label} exact'] = {'skipped': str(e)}
+            continue
+        results[f'{label} exact'] = await _measure(_exact, rounds)
+        errors = [abs(e - x) / x for e, x in zip(estimated, exact) if x]
+        results[f'{label} estimate error'] = {'items': len(errors), 'mean_error_pct': statistics.fmean(errors) * 100,
+                                              'max_error_pct': max(errors) * 100}
+    return results
+
+
+async def bench_chunking(rounds: int) -> dict:
+    # 首块耗时体现惰性切分: 原实现要先对整篇文章计数; stall 为逐块准备时事件循环的最长阻塞
+    results = dict()
+    for name, html in _article_fixtures().items():
+        soup = parse_html(html)
+        # 按段落换行的正文与整篇不换行的正文(单个超长段落, 走按句切分)
+        for label, content in ((name, paragraphs_text(soup, 'p')), (f'{name} single', soup.get_text())):
+            chunks = lambda: chunk_text(content, CHUNK_TOKEN_LIMIT, TokenCountMode.ESTIMATE)
+            label = f'{label} x{len(list(chunks()))}'
+
+            async def _first():
+                next(chunks())
+
+            async def _all():
+                list(chunks())
+
+            async def _inline():
+                for _ in chunks():
+                    await asyncio.sleep(CHUNK_ASK_DELAY)
+
+            async def _prefetch():
+                async for _ in prefetch_chunks(chunks()):
+                    await asyncio.sleep(CHUNK_ASK_DELAY)
+
+            results[f'{label} first chunk'] = await _measure(_first, rounds)
+            results[f'{label} all chunks'] = await _measure(_all, rounds)
+            for case, func in [('stall inline', _inline), ('stall prefetch', _prefetch)]:
+                results[f'{label} {case}'] = _stats([await _max_loop_stall(func) for _ in range(rounds)])
+    return results
+
+
+def _request_count(browser: Browser) -> int:
+    return sum(x['count'] for x in browser.metrics().values())
+
+
+async def bench_wait_for(server: FakeDevTools, browser: Browser, rounds: int) -> dict:
+    # 节点在 WAIT_MUTATION_DELAY 后由页面自身插入, 统计发现它的耗时与等待期间发出的命令数
+    page = browser.find_page_by_url_prefix('https://chat.openai.com')
+    loop = asyncio.get_running_loop()
+
+    def _insert(dom):
+        body = dom.root.children[0].children[-1]
+        dom.append(body, 'div', {'class': 'bench-late'}, text='late')
+        return body
+
+    def _remove(dom):
+        body = dom.root.children[0].children[-1]
+        body.children = [x for x in body.children if x.attrs.get('class') != 'bench-late']
+        return body
+
+    async def _bench(wait: Callable[[], Coroutine[Any, Any, Any]]) -> dict:
+        async def _once():
+            loop.call_later(WAIT_MUTATION_DELAY, server.mutate, page.id, _insert)
+            await wait()
+            server.mutate(page.id, _remove)
+            await page.wait_for(css='div.bench-late', state=WaitState.DETACHED, timeout=QUERY_TIMEOUT)
+
+        start_count = _request_count(browser)
+        stats = await _measure(_once, rounds)
+        stats['requests_per_round'] = (_request_count(browser) - start_count) / rounds
+        return stats
+
+    return {'query_nodes_by_css': await _bench(lambda: page.query_nodes_by_css('div.bench-late', QUERY_TIMEOUT)),
+            'wait_for': await _bench(lambda: page.wait_for(css='div.bench-late', timeout=QUERY_TIMEOUT))}
+
+
+async def bench_open_new(browser: Browser, rounds: int) -> dict:
+    async def _open_and_close():
+        page = await browser.open_new('https://example.com/bench')
+        await page.close_async()
+
+    return await _measure(_open_and_close, rounds)
+
+
+async def bench_wait_answer_done(browser: Browser, rounds: int) -> dict:
+    from .gpt.chat_gpt_page import ChatGptPage
+    chat_page = ChatGptPage(browser)
+    return await _measure(chat_page._wait_answer_done, rounds)
+
+
+async def run_benchmarks(server: FakeDevTools, rounds=DEFAULT_ROUNDS, transport=Transport.PAGE) -> dict:
+    server.add_target('https://chat.openai.com', 'ChatGPT')
+    browser = Browser(server.host, server.port, transport)
+    results = {
+        'config': {'latency': server.latency, 'jitter': server.jitter, 'dom_size': server.dom_size,
+                   'dom_depth': server.dom_depth, 'event_noise': server.event_noise, 'rounds': rounds, 'transport': transport.value},
+        'xpath_query': await bench_xpath_query(browser, rounds),
+        'css_query': await bench_css_query(browser, rounds),
+        'snapshot_query': await bench_snapshot_query(browser, rounds),
+        'traceback_node': await bench_traceback_node(browser, rounds, server.dom_depth),
+        'text_content': await bench_text_content(browser, rounds),
+        'set_props': await bench_set_props(browser, rounds),
+        'actions': await bench_actions(browser, rounds),
+        'open_new': await bench_open_new(browser, rounds),
+        'wait_for': await bench_wait_for(server, browser, rounds),
+        'node_memory': bench_node_memory(browser),
+        'html_parse': await bench_html_parse(max(1, rounds // 4)),
+    }
+    results['token_count'] = await bench_token_count(rounds)
+    results['chunking'] = await bench_chunking(max(1, rounds // 4))
+    try:
+        results['wait_answer_done'] = await bench_wait_answer_done(browser, max(1, rounds // 10))
+    except ImportError as e:
+        results['wait_answer_done'] = {'skipped': str(e)}
+    results['cdp_metrics'] = browser.metrics()
+    results['action_metrics'] = browser.action_metrics()
+    return results
+
+
+def _print_results(results: dict):
+    for name, value in results.items():
+        if name in ('config', 'cdp_metrics', 'action_metrics'):
+            continue
+        rows = value if all(isinstance(x, dict) for x in value.values()) else {'': value}
+        for case, stats in rows.items():
+            if 'skipped' in stats:
+                print(f'{name:<18} {case:<60} skipped: {stats["skipped"]}')
+                continue
+            if 'mean_error_pct' in stats:
+                print(f'{name:<18} {case:<60} mean_error={stats["mean_error_pct"]:6.2f}% '
+                      f'max_error={stats["max_error_pct"]:6.2f}% items={stats["items"]}')
+                continue
+            if 'bytes_per_node' in stats:
+                print(f'{name:<18} {case:<60} {stats["bytes_per_node"]:8.0f} bytes/node '
+                      f'build={stats["build_ms"]:8.2f}ms nodes={stats["nodes"]}')
+                continue
+            requests = f' requests={stats["requests_per_round"]:.1f}' if 'requests_per_round' in stats else ''
+            print(f'{name:<18} {case:<60} mean={stats["mean_ms"]:8.2f}ms p50={stats["p50_ms"]:8.2f}ms '
+                  f'p95={stats["p95_ms"]:8.2f}ms{requests}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CDP benchmark against a local fake DevTools server')
+    parser.add_argument('--latency', type=float, default=.002)
+    parser.add_argument('--jitter', type=float, default=.001)
+    parser.add_argument('--dom-size', type=int, default=2000)
+    parser.add_argument('--dom-depth', type=int, default=32)
+    parser.add_argument('--event-noise', type=int, default=0, help='unrelated events sent before each response')
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument('--transport', choices=[x.value for x in Transport], default=Transport.PAGE.value)
+    parser.add_argument('--output', help='write full results as json')
+    args = parser.parse_args()
+
+    with FakeDevTools(latency=args.latency, jitter=args.jitter,
+                      dom_size=args.dom_size, dom_depth=args.dom_depth, event_noise=args.event_noise) as server:
+        results = asyncio.run(run_benchmarks(server, args.rounds, Transport(args.transport)))
+    _print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,45 @@
 import asyncio
-import time
+import enum
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 from urllib.parse import quote
 
 import requests
 
 from .browser_page import BrowserPage
+from .cdp_connection import CdpConnection, ConnectionPool
+from .cdp_metrics import CdpMetrics, export_metrics
 
 FIND_INTERVAL = .1
 TIMEOUT = 5.
 FIND_TIMEOUT = 5
+HTTP_WORKERS = 4
+TARGET_EVENTS = ('Target.targetCreated', 'Target.targetInfoChanged', 'Target.targetDestroyed')
 
 
-def get_browser() -> "Browser":
-    return Browser()
+_BROWSERS = dict[str, "Browser"]()
+_BROWSERS_LOCK = threading.Lock()
+
+
+class Transport(enum.Enum):
+    # 每个标签页各自连接自己的 webSocketDebuggerUrl
+    PAGE = 'page'
+    # 只连接一次浏览器级 websocket, 通过 Target.attachToTarget(flatten=true) 的 session 访问各标签页
+    BROWSER = 'browser'
+
+
+def get_browser(ip='127.0.0.1', port=9100, transport: Optional[Transport] = None) -> "Browser":
+    # 同一调试地址在进程内共享一个 Browser, 各处的标签页缓存与连接随之共享
+    address = f'{ip}:{port}'
+    with _BROWSERS_LOCK:
+        browser = _BROWSERS.get(address)
+        if not browser:
+            browser = _BROWSERS[address] = Browser(ip, port, transport or Transport.PAGE)
+    if transport and browser.transport != transport:
+        browser.set_transport(transport)
+    return browser
 
 
 class TabNotFoundError(Exception):
@@ -22,25 +48,148 @@ class TabNotFoundError(Exception):
 
 
 class Browser:
-    def __init__(self, ip='127.0.0.1', port=9100):
+    def __init__(self, ip='127.0.0.1', port=9100, transport=Transport.PAGE):
         self.ip = ip
         self.port = port
         self.address = f'{ip}:{port}'
-        self._page_cache = list[BrowserPage]()
+        self._targets = dict[str, BrowserPage]()
+        self._targets_lock = threading.Lock()
+        self._targets_live = False
+        # 开启 discover 时浏览器连接的 epoch; 重连后新 websocket 上需要重新开启
+        self._targets_epoch = 0
+        # 标签页表与连接池只在 watch_targets 所在的事件循环上修改
+        self._targets_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.cdp_metrics = CdpMetrics()
+        self._browser_connection: Optional[CdpConnection] = None
+        # DevTools HTTP 接口共用一个 keep-alive 会话; 协程中经由线程池调用, 不阻塞 Qt 事件循环
+        self._http_session = requests.Session()
+        self._http_executor = ThreadPoolExecutor(HTTP_WORKERS, thread_name_prefix=f'devtools-http {self.address}')
+        self.transport = transport
+        self.connections = self._create_pool()
+
+    def _create_pool(self) -> ConnectionPool:
+        if self.transport == Transport.BROWSER:
+            return ConnectionPool(self.cdp_metrics, browser_connection=self.browser_connection)
+        return ConnectionPool(self.cdp_metrics)
+
+    def set_transport(self, transport: Transport):
+        old_pool = self.connections
+        self.transport = transport
+        self.connections = self._create_pool()
+        old_pool.close()
+
+    def http(self, method: str, path: str, timeout: float = TIMEOUT) -> requests.Response:
+        return self._http_session.request(method, f'http://{self.address}{path}', timeout=timeout)
+
+    async def http_async(self, method: str, path: str, timeout: float = TIMEOUT) -> requests.Response:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._http_executor, functools.partial(self.http, method, path, timeout))
+
+    def _set_browser_connection(self, version: dict) -> CdpConnection:
+        if not self._browser_connection:
+            self._browser_connection = CdpConnection(version['webSocketDebuggerUrl'], metrics=self.cdp_metrics)
+        return self._browser_connection
+
+    def browser_connection(self) -> CdpConnection:
+        if self._browser_connection:
+            return self._browser_connection
+        return self._set_browser_connection(self.http('GET', '/json/version').json())
+
+    async def browser_connection_async(self) -> CdpConnection:
+        if self._browser_connection:
+            return self._browser_connection
+        return self._set_browser_connection((await self.http_async('GET', '/json/version')).json())
+
+    def metrics(self) -> dict[str, dict]:
+        return self.cdp_metrics.snapshot()
+
+    def action_metrics(self) -> dict[str, dict]:
+        return self.cdp_metrics.action_snapshot()
+
+    def export_metrics(self, fmt='json', path: Optional[str] = None) -> str:
+        return export_metrics(self.metrics(), fmt, path)
+
+    async def watch_targets(self):
+        # 订阅 Target 事件维护内存中的标签页表, 之后的查找与等待不再请求 /json
+        connection = await self.browser_connection_async()
+        if self.targets_live:
+            return
+        await connection.ensure_open()
+        self._targets_loop = asyncio.get_running_loop()
+        events = connection.events
+        events.remove_listener(self._on_target_event)
+        events.add_listener(self._on_target_event, *TARGET_EVENTS)
+        epoch = connection.epoch
+        result = await connection.request('Target.getTargets', {}, TIMEOUT)
+        infos = result.get('result', {}).get('targetInfos', [])
+        live_ids = {x['targetId'] for x in infos}
+        with self._targets_lock:
+            for target_id in [x for x in self._targets if x not in live_ids]:
+                del self._targets[target_id]
+        for info in infos:
+            if info['type'] == 'page':
+                self._put_page(self._page_from_info(info))
+        await connection.request('Target.setDiscoverTargets', {'discover': True}, TIMEOUT)
+        self._targets_epoch = epoch
+        self._targets_live = True
+
+    def _on_target_event(self, event: dict):
+        # 在连接的读线程中调用, 转到事件循环上处理, 避免与协程并发修改连接池和 BrowserPage
+        try:
+            self._targets_loop.call_soon_threadsafe(self._apply_target_event, event)
+        except RuntimeError:
+            # 事件循环已关闭, 标签页表不再可信, 回退到 /json
+            self._targets_live = False
+
+    def _apply_target_event(self, event: dict):
+        params = event.get('params', {})
+        if event['method'] == 'Target.targetDestroyed':
+            with self._targets_lock:
+                page = self._targets.pop(params['targetId'], None)
+            if page:
+                page.close_connection()
+            self.connections.discard(params['targetId'])
+            return
+        info = params['targetInfo']
+        if info['type'] != 'page':
+            return
+        self._put_page(self._page_from_info(info))
+
+    def _page_from_info(self, info: dict) -> BrowserPage:
+        return BrowserPage(self, id=info['targetId'], url=info['url'], title=info['title'],
+                           webSocketDebuggerUrl=f'ws://{self.address}/devtools/page/{info["targetId"]}')
+
+    def _put_page(self, page: BrowserPage) -> BrowserPage:
+        with self._targets_lock:
+            exists = self._targets.setdefault(page.id, page)
+        if exists is not page:
+            self._update_page(exists, page)
+        return exists
+
+    @property
+    def targets_live(self) -> bool:
+        # 浏览器连接重连过 (epoch 变化) 时新连接上还没有 discover, 表不再更新
+        connection = self._browser_connection
+        return (self._targets_live and bool(connection) and connection.connected
+                and connection.epoch == self._targets_epoch)
 
     @property
     def pages(self) -> list[BrowserPage]:
-        pages_data = requests.get(f'http://{self.address}/json').json()
-        result = list[BrowserPage]()
-        for data in filter(lambda x: x['type'] == 'page', pages_data):
-            page = BrowserPage(self, **data)
-            exists = next(iter([x for x in self._page_cache if x.id == page.id]), None)
-            if exists:
-                self._update_page(exists, page)
-                result.append(exists)
-            else:
-                result.append(page)
-        self._page_cache = result
+        if self.targets_live:
+            with self._targets_lock:
+                return list(self._targets.values())
+        return self._reset_pages(self.http('GET', '/json').json())
+
+    async def pages_async(self) -> list[BrowserPage]:
+        if self.targets_live:
+            with self._targets_lock:
+                return list(self._targets.values())
+        return self._reset_pages((await self.http_async('GET', '/json')).json())
+
+    def _reset_pages(self, pages_data: list[dict]) -> list[BrowserPage]:
+        result = [self._put_page(BrowserPage(self, **data)) for data in pages_data if data['type'] == 'page']
+        with self._targets_lock:
+            self._targets = {x.id: x for x in result}
         return result
 
     @staticmethod
@@ -62,27 +211,27 @@ class Browser:
                    default=None, key=lambda y: len(y.url))
 
     async def find_or_open(self, prefix: str, activate=False, timeout=FIND_INTERVAL) -> BrowserPage:
+        await self.watch_targets()
         page = self.find_page_by_url_prefix(prefix)
         if page:
             if activate:
-                page.activate()
+                await page.activate_async()
             return page
         return await self.open_new(prefix, timeout)
 
     async def open_new(self, url: str, timeout=FIND_INTERVAL) -> BrowserPage:
-        old_pages = self.pages
-        requests.put(f'http://{self.address}/json/new?{quote(url)}')
-        end_time = time.perf_counter() + timeout
-        while len(old_pages) == len(self.pages) and time.perf_counter() < end_time:
-            await asyncio.sleep(FIND_INTERVAL)
-        old_ids = {x.id for x in old_pages}
-        new_tab = next(iter([x for x in self.pages if x.id not in old_ids]), None)
-        if not new_tab:
-            raise TabNotFoundError('new tab', f'url={url}')
-        return new_tab
+        # /json/new 直接返回新标签页的信息, 无需轮询 /json 等待其出现
+        response = await self.http_async('PUT', f'/json/new?{quote(url)}', timeout + TIMEOUT)
+        if not response.ok:
+            raise TabNotFoundError('new tab', f'url={url}', response.text)
+        return self._put_page(BrowserPage(self, **response.json()))
 
     def required_page_by_id(self, page_id) -> BrowserPage:
-        page = next(filter(lambda x: x.id == page_id, self.pages), None)
+        if self.targets_live:
+            with self._targets_lock:
+                page = self._targets.get(page_id)
+        else:
+            page = next(filter(lambda x: x.id == page_id, self.pages), None)
         if not page:
             raise TabNotFoundError('page', f'id={page_id}')
         return page
@@ -1,12 +1,106 @@
 import enum
 from typing import Any, Optional, Self, TYPE_CHECKING, Type
 
-from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4 import BeautifulSoup
 
+from .html_parse import current_parser, parse_html_async
 if TYPE_CHECKING:
     from .browser_page import BrowserPage
 
 COMMAND_TIMEOUT = 1
+# 文本在页面内计算后按值返回, 不再下载 outerHTML 在本地解析
+TEXT_CONTENT_FUNCTION = 'function() { return this.textContent || ""; }'
+RENDERED_TEXT_FUNCTION = 'function() { return this.innerText === undefined ? this.textContent || "" : this.innerText; }'
+DIRECT_TEXT_FUNCTION = '''function() {
+    return Array.from(this.childNodes).filter(x => x.nodeType === Node.TEXT_NODE).map(x => x.data).join("");
+}'''
+# 自父节点向上到 <html> 的祖先链, 与 NODE_LIST_SERIALIZATION 配合一次取回全部祖先的节点信息
+ANCESTORS_FUNCTION = '''function() {
+    const chain = [];
+    for (let node = this.parentNode; node && node.nodeType === Node.ELEMENT_NODE; node = node.parentNode) {
+        chain.push(node);
+    }
+    return chain;
+}'''
+PARENT_NODE_FUNCTION = 'function() { return this.parentNode; }'
+# 一次调用给多个节点设置同一组属性 (值为 null 时删除), 按值返回各节点更新后的全部属性
+SET_ATTRIBUTES_FUNCTION = '''function(attributes, ...nodes) {
+    return nodes.map(node => {
+        for (const [name, value] of Object.entries(attributes)) {
+            if (value === null) {
+                node.removeAttribute(name);
+            } else {
+                node.setAttribute(name, String(value));
+            }
+        }
+        return Object.fromEntries(Array.from(node.attributes, x => [x.name, x.value]));
+    });
+}'''
+CLEAR_VALUE_FUNCTION = 'function() {this.value = ""}'
+ENTER_KEY_EVENT = {'type': 'keyDown', 'key': 'Enter', 'code': 'Enter', 'nativeVirtualKeyCode': 13,
+                   'windowsVirtualKeyCode': 13}
+# 节点数组的 deep 序列化: 每个节点带 backendNodeId/localName/attributes/childNodeCount, 不含子节点
+NODE_LIST_SERIALIZATION = {'serialization': 'deep', 'maxDepth': 1,
+                           'additionalParameters': {'maxNodeDepth': 0, 'includeShadowTree': 'none'}}
+# 节点的稳定选择器路径: 从最近的唯一 id 祖先 (没有则从 <html>) 起逐级 :nth-child 定位
+_CSS_PATH_JS = '''const path = node => {
+        const steps = [];
+        for (let el = node; el && el.nodeType === Node.ELEMENT_NODE; el = el.parentElement) {
+            if (el.id && document.querySelectorAll('#' + CSS.escape(el.id)).length === 1) {
+                steps.unshift('#' + CSS.escape(el.id));
+                break;
+            }
+            const parent = el.parentElement;
+            steps.unshift(parent ? `${el.localName}:nth-child(${Array.prototype.indexOf.call(parent.children, el) + 1})`
+                                 : el.localName);
+        }
+        return steps.join(' > ');
+    };'''
+# 页面内 querySelectorAll, 每个结果附带选择器路径
+CSS_QUERY_FUNCTION = f'''(function (selector) {{
+    {_CSS_PATH_JS}
+    return Array.from(document.querySelectorAll(selector), node => [node, path(node)]);
+}})'''
+# 一次调用按值返回多个节点的选择器路径, 用于 DOM.querySelectorAll 的结果
+CSS_PATHS_FUNCTION = f'''function(...nodes) {{
+    {_CSS_PATH_JS}
+    return nodes.map(path);
+}}'''
+# [节点, 路径] 二元组数组的 deep 序列化
+NODE_PATH_SERIALIZATION = {'serialization': 'deep', 'maxDepth': 2,
+                           'additionalParameters': {'maxNodeDepth': 0, 'includeShadowTree': 'none'}}
+
+
+def describe_serialized(value: dict) -> dict:
+    # deep 序列化的节点转换为 DOM.describeNode 的结构
+    node = value['value']
+    return {
+        'backendNodeId': node['backendNodeId'],
+        'nodeType': node.get('nodeType', 1),
+        'localName': node.get('localName', ''),
+        'nodeValue': node.get('nodeValue', ''),
+        'childNodeCount': node.get('childNodeCount', 0),
+        'attributes': [x for kv in node.get('attributes', {}).items() for x in kv],
+    }
+
+
+def serialized_node_list(serialized: dict) -> Optional[list[dict]]:
+    items = serialized.get('value', [])
+    if any(x.get('type') != 'node' or 'backendNodeId' not in x.get('value', {}) for x in items):
+        return None
+    return [describe_serialized(x) for x in items]
+
+
+def serialized_node_paths(serialized: dict) -> Optional[list[dict]]:
+    pairs = [x.get('value', []) for x in serialized.get('value', [])]
+    if any(len(x) != 2 or x[1].get('type') != 'string' for x in pairs):
+        return None
+    data_list = serialized_node_list({'value': [x[0] for x in pairs]})
+    if data_list is None:
+        return None
+    for data, (_, path) in zip(data_list, pairs):
+        data['cssPath'] = path['value']
+    return data_list
 
 
 class NodePseudoType(enum.Enum):
@@ -23,34 +117,103 @@ class JsExecuteException(Exception):
         super().__init__(*args, **kwargs)
 
 
+class NoCssPathError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
 class PageNode:
-    _node_id: int = 0
-    name: str
-    child_count: int
-    _attributes: dict
-    _pseudo_type: str
-    _outer_html: Optional[str] = None
-    _object: Optional[dict] = None
-    _parent_node: Optional[Self] = None
-
-    def __init__(self, page: "BrowserPage", x_path: str, **kwargs):
+    # 页面上可能同时存在成百上千个节点: 只保留 describe 的原始结果, 属性与伪元素在首次访问时才解析
+    __slots__ = ('page', 'x_path', 'css_path', 'backend_id', '_node_id', '_data', '_attrs', '_pseudo_nodes',
+                 '_outer_html', '_soup', '_texts', '_object', '_parent_node', '_chain_top', '__weakref__')
+
+    def __init__(self, page: "BrowserPage", x_path: str, data: dict):
         self.page = page
         self.x_path = x_path
-        self.backend_id: int = kwargs['backendNodeId']
-        self._update_node_info(kwargs)
+        # 经 CSS 查询得到的节点才有, 可拼接后代选择器做相对查询: f'{node.css_path} p'
+        self.css_path = ''
+        self.backend_id: int = data['backendNodeId']
+        self._node_id = 0
+        self._outer_html: Optional[str] = None
+        self._soup: Optional[BeautifulSoup] = None
+        self._texts: Optional[dict[str, str]] = None
+        self._object: Optional[dict] = None
+        self._parent_node: Optional[Self] = None
+        # 已确认没有元素父节点 (<html> 或 shadow root 的顶层元素), 祖先链到此为止
+        self._chain_top = False
+        self._update_node_info(data)
+
+    def descendant_css(self, *selectors: str) -> str:
+        # 以本节点为上下文的后代选择器; 没有路径时拼出的选择器会匹配整个文档, 因此直接报错
+        if not self.css_path:
+            raise NoCssPathError(self.backend_id, self.x_path, selectors)
+        return ', '.join(f'{self.css_path} {x}' for x in selectors)
 
     def _update_node_info(self, node_result: dict):
-        self.name = node_result['localName']
-        self.child_count = node_result['childNodeCount']
-        flatter_attrs: list[str] = node_result['attributes']
-        self._attributes = {flatter_attrs[i]: flatter_attrs[i + 1] for i in range(0, len(flatter_attrs), 2)}
-        self._pseudo_type = node_result.get('pseudoType')
-        nodes_data = node_result.get('pseudoElements')
-        self.pseudo_nodes = [PageNode(self.page, '', **data) for data in (nodes_data if nodes_data else [])]
+        if node_result.get('nodeId'):
+            self._node_id = node_result['nodeId']
+        if node_result.get('cssPath'):
+            self.css_path = node_result['cssPath']
+        self._data = node_result
+        self._attrs: Optional[dict[str, str]] = None
+        self._pseudo_nodes: Optional[list[PageNode]] = None
+
+    @property
+    def name(self) -> str:
+        return self._data.get('localName', '')
+
+    @property
+    def child_count(self) -> int:
+        return self._data.get('childNodeCount', 0)
+
+    @child_count.setter
+    def child_count(self, value: int):
+        self._data['childNodeCount'] = value
+
+    @property
+    def _attributes(self) -> dict[str, str]:
+        if self._attrs is None:
+            flatter_attrs: list[str] = self._data.get('attributes', [])
+            self._attrs = {flatter_attrs[i]: flatter_attrs[i + 1] for i in range(0, len(flatter_attrs), 2)}
+        return self._attrs
+
+    @_attributes.setter
+    def _attributes(self, value: dict[str, str]):
+        self._attrs = value
+
+    @property
+    def _pseudo_type(self) -> Optional[str]:
+        return self._data.get('pseudoType')
+
+    @property
+    def pseudo_nodes(self) -> list[Self]:
+        if self._pseudo_nodes is None:
+            self._pseudo_nodes = [PageNode(self.page, '', data) for data in self._data.get('pseudoElements', [])]
+        return self._pseudo_nodes
+
+    def _refresh(self, x_path: str, node_result: dict):
+        # 重新查询到同一节点: 结构信息以本次结果为准, 内容缓存作废, objectId 等身份信息保留
+        if x_path:
+            self.x_path = x_path
+        self._update_node_info(node_result)
+        self.invalidate_content()
+
+    def invalidate_content(self):
+        self._outer_html = None
+        self._soup = None
+        self._texts = None
+
+    def _invalidate_identity(self):
+        self._node_id = 0
+        self._object = None
+        self._parent_node = None
+        self._chain_top = False
+        self.invalidate_content()
 
     async def update_node(self):
         node_info = await self._describe_node(backend_id=self.backend_id)
         self._update_node_info(node_info)
+        self.invalidate_content()
 
     async def _describe_node(self, *, node_id: int = 0, backend_id: int = 0):
         params = dict()
@@ -67,20 +230,15 @@ class PageNode:
     def has_prop(self, name):
         return name in self._attributes
 
-    async def set_props(self, kv_dict: Optional[dict] = None, **kwargs):
-        kv_dict = dict(**kv_dict) if kv_dict else dict()
-        kv_dict.update(kwargs)
-        await self._ensure_node_id()
-        for name, value in kv_dict.items():
-            await self.page.command_result('DOM.setAttributeValue', COMMAND_TIMEOUT,
-                                           nodeId=self._node_id, name=name, value=value)
-        await self.update_node()
+    async def set_props(self, kv_dict: Optional[dict] = None, **kwargs) -> dict:
+        return (await self.page.set_nodes_props([self], kv_dict, **kwargs))[0]
 
     async def _ensure_node_id(self):
         if not self._node_id:
             result = await self.page.command_result('DOM.pushNodesByBackendIdsToFrontend', COMMAND_TIMEOUT,
                                                     backendNodeIds=[self.backend_id])
             self._node_id = result['nodeIds'][0]
+            self.page.bind_node_id(self._node_id, self.backend_id)
 
     @property
     def pseudo_type(self) -> Optional[NodePseudoType]:
@@ -88,22 +246,46 @@ class PageNode:
 
     @property
     async def outer_html(self) -> str:
+        self.page.sync_nodes()
         if self._outer_html is None:
             result = await self.page.command_result('DOM.getOuterHTML', COMMAND_TIMEOUT,
                                                     backendNodeId=self.backend_id)
             self._outer_html = result['outerHTML']
         return self._outer_html
 
+    @property
+    async def parsed_html(self) -> BeautifulSoup:
+        # 按节点缓存 outerHTML 的解析结果, 调用方只读不改; 切换解析器后重新解析
+        html = await self.outer_html
+        if self._soup is None or self._soup.builder.NAME != current_parser():
+            self._soup = await parse_html_async(html)
+        return self._soup
+
+    async def _text(self, js: str) -> str:
+        self.page.sync_nodes()
+        if self._texts is None:
+            self._texts = dict()
+        text = self._texts.get(js)
+        if text is None:
+            text = self._texts[js] = await self._call_value(js)
+        return text
+
     @property
     async def text_content(self) -> str:
-        return BeautifulSoup(await self.outer_html, 'html.parser').text
+        if self._pseudo_type:
+            # 伪元素无法解析为 JS 对象, 仍从 outerHTML 取文本
+            return (await self.parsed_html).text
+        return await self._text(TEXT_CONTENT_FUNCTION)
+
+    @property
+    async def rendered_text(self) -> str:
+        # innerText: 按渲染结果取文本, 不含隐藏元素, 块级元素之间有换行
+        return await self._text(RENDERED_TEXT_FUNCTION)
 
     @property
     async def inner_text(self) -> str:
-        tag = BeautifulSoup(await self.outer_html, 'html.parser').contents[0]
-        if not isinstance(tag, Tag):
-            return ''
-        return ''.join([x for x in tag.children if isinstance(x, NavigableString)])
+        # 仅直接子文本节点的内容
+        return await self._text(DIRECT_TEXT_FUNCTION)
 
     @property
     async def object_id(self) -> str:
@@ -115,59 +297,153 @@ class PageNode:
 
     @property
     async def parent(self) -> Optional[Self]:
-        if self.name == 'html':
+        if not self._parent_node and not self._chain_top:
+            await self.ancestors()
+        return self._parent_node
+
+    def _linked_ancestors(self) -> Optional[list[Self]]:
+        chain = list[Self]()
+        node = self
+        while not node._chain_top:
+            node = node._parent_node
+            if not node:
+                return None
+            chain.append(node)
+        return chain
+
+    async def ancestors(self) -> list[Self]:
+        # 由近到远直到没有元素父节点为止; 一次页面内遍历取回整条链, 并填好沿途各节点的 parent 链接
+        chain = self._linked_ancestors()
+        if chain is not None:
+            return chain
+        data_list = await self._evaluate_ancestors()
+        if data_list is None:
+            return await self._query_ancestors()
+        node = self
+        chain = list[Self]()
+        for i, data in enumerate(data_list):
+            x_path = f'{self.x_path}{"/.." * (i + 1)}' if self.x_path else ''
+            parent = self.page.node(x_path, data, keep_path=True)
+            node._parent_node = parent
+            chain.append(parent)
+            node = parent
+        node._chain_top = True
+        return chain
+
+    async def _evaluate_ancestors(self) -> Optional[list[dict]]:
+        if not self.page.in_page_queries:
             return None
-        if not self._parent_node:
-            nodes = await self.page.query_nodes_by_xpath(f'{self.x_path}/..', COMMAND_TIMEOUT)
-            if nodes:
-                self._parent_node = nodes[0]
-        return self._parent_node if self._parent_node.backend_id else None
+        result = await self._call_function_on(ANCESTORS_FUNCTION, serializationOptions=NODE_LIST_SERIALIZATION)
+        serialized = result['result'].get('deepSerializedValue')
+        if result.get('exceptionDetails') or not serialized:
+            return None
+        return serialized_node_list(serialized)
+
+    async def _query_ancestors(self) -> list[Self]:
+        # 浏览器不支持 deep 序列化时按节点身份逐级取 parentNode, 不依赖 xpath (CSS 查询得到的节点没有)
+        chain = list[Self]()
+        node = self
+        while not node._chain_top:
+            if not node._parent_node:
+                parent = await node._describe_parent()
+                if not parent:
+                    node._chain_top = True
+                    break
+                node._parent_node = parent
+            node = node._parent_node
+            chain.append(node)
+        return chain
+
+    async def _describe_parent(self) -> Optional[Self]:
+        result = await self._call_function_on(PARENT_NODE_FUNCTION)
+        parent_object = result['result']
+        if result.get('exceptionDetails') or not parent_object.get('objectId'):
+            return None
+        described = await self.page.command_result('DOM.describeNode', COMMAND_TIMEOUT,
+                                                    objectId=parent_object['objectId'])
+        if described['node']['nodeType'] != 1:
+            return None
+        parent = self.page.node(f'{self.x_path}/..' if self.x_path else '', described['node'], keep_path=True)
+        if not parent._object:
+            parent._object = parent_object
+        return parent
 
     async def js_click(self):
+        # 点击/输入会改变页面, 已缓存的文本不再可信
+        self.page.invalidate_node_contents()
         result = await self._call_function_on('function() {this.click()}')
         e = result.get('exceptionDetails')
         if e:
             raise JsExecuteException(e)
 
+    async def _center(self) -> tuple[float, float]:
+        # 滚动到可见与取几何信息合并为一次往返, 返回第一个内容框的中心点
+        _, result = await self.page.command_batch([
+            ('DOM.scrollIntoViewIfNeeded', {'backendNodeId': self.backend_id}),
+            ('DOM.getContentQuads', {'backendNodeId': self.backend_id})], COMMAND_TIMEOUT)
+        quad = result['quads'][0]
+        return sum(quad[0::2]) / 4, sum(quad[1::2]) / 4
+
+    async def _dispatch_mouse(self, *events: tuple[str, dict]):
+        x, y = await self._center()
+        await self.page.command_batch([('Input.dispatchMouseEvent', dict(params, type=mouse_type, x=x, y=y))
+                                       for mouse_type, params in events], COMMAND_TIMEOUT)
+
+    async def hover(self):
+        with self.page.timed_action('hover'):
+            await self._dispatch_mouse(('mouseMoved', {}))
+
+    async def click(self, button='left', click_count=1):
+        # 几何一次往返, 移动/按下/抬起一次往返
+        with self.page.timed_action('click'):
+            self.page.invalidate_node_contents()
+            await self._dispatch_mouse(('mouseMoved', {}),
+                                       ('mousePressed', {'button': button, 'clickCount': click_count}),
+                                       ('mouseReleased', {'button': button, 'clickCount': click_count}))
+
     async def left_click(self):
-        await self.scroll_into_view()
-        result = await self.page.command_result('DOM.getContentQuads', COMMAND_TIMEOUT,
-                                                backendNodeId=self.backend_id)
-        x1, y1, x2, _, _, y2, _, _ = tuple(result['quads'][0])
-        x, y = (x1 + x2) // 2, (y1 + y2) // 2
-        for mouse_type in ['mousePressed', 'mouseReleased']:
-            await self.page.command_result('Input.dispatchMouseEvent', COMMAND_TIMEOUT,
-                                           type=mouse_type, x=x, y=y, button='left')
-
-    async def _call_function_on(self, js: str):
+        await self.click()
+
+    async def type_and_submit(self, content: str, submit=True):
+        # 聚焦/清空/输入/回车按序一次写出, objectId 已缓存时只需一次往返
+        with self.page.timed_action('type_and_submit' if submit else 'type'):
+            self.page.invalidate_node_contents()
+            await self.page.resolve_nodes([self])
+            commands = [('DOM.focus', {'backendNodeId': self.backend_id}),
+                        ('Runtime.callFunctionOn', {'functionDeclaration': CLEAR_VALUE_FUNCTION,
+                                                    'objectId': self._object['objectId']}),
+                        ('Input.insertText', {'text': content})]
+            if submit:
+                commands.append(('Input.dispatchKeyEvent', ENTER_KEY_EVENT))
+            results = await self.page.command_batch(commands, COMMAND_TIMEOUT)
+            e = results[1].get('exceptionDetails')
+            if e:
+                raise JsExecuteException(e)
+
+    async def _call_function_on(self, js: str, **params):
         return await self.page.command_result('Runtime.callFunctionOn', COMMAND_TIMEOUT,
-                                              functionDeclaration=js, objectId=await self.object_id)
+                                              functionDeclaration=js, objectId=await self.object_id, **params)
+
+    async def _call_value(self, js: str) -> Any:
+        result = await self._call_function_on(js, returnByValue=True)
+        e = result.get('exceptionDetails')
+        if e:
+            raise JsExecuteException(e)
+        return result['result'].get('value')
 
     async def submit_input(self, content: str):
-        await self.page.command_result('DOM.focus', COMMAND_TIMEOUT,
-                                       backendNodeId=self.backend_id)
-        await self._call_function_on('function() {this.value = ""}')
-        await self.page.command_result('Input.insertText', COMMAND_TIMEOUT,
-                                       text=content)
-        await self.trigger_entry_key()
+        await self.type_and_submit(content)
 
     async def trigger_entry_key(self):
-        await self.page.command_result('Input.dispatchKeyEvent', COMMAND_TIMEOUT,
-                                       type='keyDown', key='Enter', code='Enter',
-                                       nativeVirtualKeyCode=13, windowsVirtualKeyCode=13)
+        self.page.invalidate_node_contents()
+        await self.page.command_result('Input.dispatchKeyEvent', COMMAND_TIMEOUT, **ENTER_KEY_EVENT)
 
     async def scroll_into_view(self):
         await self.page.command_result('DOM.scrollIntoViewIfNeeded', COMMAND_TIMEOUT,
                                        backendNodeId=self.backend_id)
 
     async def traceback_node(self) -> list[Self]:
-        node = self
-        path_trace = [node]
-        while node:
-            node = await node.parent
-            if node:
-                path_trace.append(node)
-        return path_trace
+        return [self] + await self.ancestors()
 
 
 def main():
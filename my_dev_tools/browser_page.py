@@ -1,22 +1,96 @@
 import asyncio
+import contextlib
 import enum
 import json
 import time
-from typing import Optional, Any, Self
+import uuid
+import weakref
+from typing import Any, Callable, Coroutine, Optional, Sequence
 
-import requests
-import websocket
-from websocket import WebSocket, WebSocketException
+from .browser_dom import (CSS_PATHS_FUNCTION, CSS_QUERY_FUNCTION, NODE_LIST_SERIALIZATION, NODE_PATH_SERIALIZATION,
+                          SET_ATTRIBUTES_FUNCTION, JsExecuteException, PageNode, serialized_node_list,
+                          serialized_node_paths)
+from .cdp_connection import CdpConnection, CdpSession, ConnectionPool
+from .cdp_events import EventBus, EventSubscription
+from .dom_snapshot import DomSnapshot
 
-from . import config
-from .browser_dom import PageNode
-
-COMMAND_SENT_CHECK_TIMEOUT = 10
-COMMAND_RESULT_CHECK_INTERVAL = .01
-MIN_RECEIVE_TIMEOUT = .05
 COMMAND_TIMEOUT = 2
-CONNECTION_TIMEOUT = 5
 NODE_FIND_LOOP_INTERVAL = .1
+CLOSE_WAIT_TIMEOUT = 5
+SNAPSHOT_TIMEOUT = 5
+WAIT_FOR_TIMEOUT = 10
+TEXT_STABLE_INTERVAL = .3
+WAIT_BINDING = '__myDevToolsWaitFor'
+DOM_MUTATION_EVENTS = ('DOM.documentUpdated', 'DOM.setChildNodes', 'DOM.childNodeInserted', 'DOM.childNodeRemoved',
+                       'DOM.childNodeCountUpdated', 'DOM.characterDataModified', 'DOM.attributeModified',
+                       'DOM.attributeRemoved')
+# 在页面内执行 XPath, 结果经 deep 序列化直接带回 backendNodeId 与节点信息, 一次往返完成查询
+XPATH_QUERY_FUNCTION = '''(function (xpath) {
+    const result = document.evaluate(xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    const nodes = [];
+    for (let i = 0; i < result.snapshotLength; i++) {
+        nodes.push(result.snapshotItem(i));
+    }
+    return nodes;
+})'''
+# 页面内等待: 立即检查一次, 之后每批 DOM 变更检查一次, 条件满足时经 binding 回调 options.id
+# text_stable 为匹配节点的文本在 settle 毫秒内不再变化; 到 timeout 毫秒后 observer 自行断开
+WAIT_FOR_FUNCTION = '''(function (options) {
+    const find = () => {
+        if (options.kind === 'css') {
+            return Array.from(document.querySelectorAll(options.query));
+        }
+        const result = document.evaluate(options.query, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        const nodes = [];
+        for (let i = 0; i < result.snapshotLength; i++) {
+            nodes.push(result.snapshotItem(i));
+        }
+        return nodes;
+    };
+    let done = false, observer = null, settleTimer = null, expireTimer = null, lastText = null;
+    const stop = () => {
+        done = true;
+        if (observer) {
+            observer.disconnect();
+        }
+        clearTimeout(settleTimer);
+        clearTimeout(expireTimer);
+    };
+    const finish = () => {
+        stop();
+        window[options.binding](options.id);
+    };
+    const check = () => {
+        const nodes = find();
+        if (options.state === 'attached' && nodes.length) {
+            finish();
+        } else if (options.state === 'detached' && !nodes.length) {
+            finish();
+        } else if (options.state === 'text_stable') {
+            const text = nodes.length ? nodes.map(x => x.textContent).join('\\n') : null;
+            if (text !== lastText) {
+                lastText = text;
+                clearTimeout(settleTimer);
+                if (text !== null) {
+                    settleTimer = setTimeout(finish, options.settle);
+                }
+            }
+        }
+    };
+    check();
+    if (done) {
+        return;
+    }
+    observer = new MutationObserver(check);
+    observer.observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    expireTimer = setTimeout(stop, options.timeout);
+})'''
+
+
+class WaitState(enum.Enum):
+    ATTACHED = 'attached'
+    DETACHED = 'detached'
+    TEXT_STABLE = 'text_stable'
 
 
 class WsRequestContext:
@@ -34,11 +108,6 @@ class WsRequestContext:
         return not self.exception and time.perf_counter() < self._expire
 
 
-class PageFlag(enum.Flag):
-    NONE = 0x0
-    DOM_ENABLED = 0x1
-
-
 class NodeNotFoundError(Exception):
     def __init__(self, *args):
         super().__init__(*args)
@@ -64,81 +133,274 @@ class BrowserPage:
         self.title = kwargs['title']
         self.websocket_url = kwargs['webSocketDebuggerUrl']
 
-        self._ws: Optional[WebSocket] = None
-        self.page_flag = PageFlag.NONE
+        self._connection: Optional[CdpConnection | CdpSession] = None
+        self._pool: Optional[ConnectionPool] = None
+        # 浏览器不支持 deep 序列化时关闭页面内查询, 之后都走 DOM.performSearch
+        self.in_page_queries = True
+        # backendNodeId -> PageNode, 多次查询返回同一节点时复用已解析的 objectId/nodeId/父节点
+        self._nodes = weakref.WeakValueDictionary[int, PageNode]()
+        # nodeId -> backendNodeId, 用于把 DOM 变更事件定位到缓存的节点
+        self._node_ids = dict[int, int]()
+        self._mutations: Optional[EventSubscription] = None
+        self._mutations_bus: Optional[EventBus] = None
+        self._nodes_epoch = 0
 
     def update(self):
         return self._browser.required_page_by_id(self.id)
 
-    def _ensure_ws(self):
-        if not self._ws:
-            self._create_and_init_ws()
-
-    def _create_and_init_ws(self):
-        self._ws: WebSocket = websocket.create_connection(self.websocket_url, CONNECTION_TIMEOUT)
-        self._ws.ping()
+    def _acquire_connection(self) -> CdpConnection | CdpSession:
+        pool = self._browser.connections
+        if not self._connection or self._connection.websocket_url != self.websocket_url or self._pool is not pool:
+            self.close_connection()
+            self._connection = pool.acquire(self.id, self.websocket_url)
+            self._pool = pool
+        return self._connection
 
-    def _recv(self, timeout: float) -> str:
-        self._ensure_ws()
-        timeout = max(MIN_RECEIVE_TIMEOUT, timeout)
-        self._ws.settimeout(timeout=timeout)
-        return self._ws.recv()
+    @property
+    def events(self) -> EventBus:
+        return self._acquire_connection().events
+
+    async def _ensure_ws(self) -> CdpConnection | CdpSession:
+        connection = self._acquire_connection()
+        if not connection.healthy() or connection.domains.stale(connection.epoch):
+            await self._create_and_init_ws()
+        return connection
+
+    async def _create_and_init_ws(self):
+        connection = self._acquire_connection()
+        await connection.ensure_open()
+        if not connection.domains.stale(connection.epoch):
+            return
+        # 新连接上重放之前启用过的 domain, 批量写出后统一等待结果;
+        # 启用失败的 domain 清除记录, 下次 enable_domain 时重新启用并抛出错误
+        replay = connection.domains.reset(connection.epoch)
+        results = await self.command_batch([(f'{domain}.enable', params) for domain, params in replay],
+                                           COMMAND_TIMEOUT, return_exceptions=True)
+        for (domain, _), result in zip(replay, results):
+            if isinstance(result, BaseException):
+                connection.domains.mark_disabled(domain)
+
+    def _discard_connection(self):
+        self.close_connection()
+        self._browser.connections.discard(self.id)
 
     def close(self):
-        if self._ws:
-            self._ws.close()
-        requests.get(f'http://{self.address}/json/close/{self.id}')
-
-    async def close_and_wait(self):
-        self.close()
-        while self.id in [x.id for x in self._browser.pages]:
-            await asyncio.sleep(0.1)
+        self._discard_connection()
+        self._browser.http('GET', f'/json/close/{self.id}')
+
+    async def close_async(self):
+        self._discard_connection()
+        await self._browser.http_async('GET', f'/json/close/{self.id}')
+
+    async def close_and_wait(self, timeout: float = CLOSE_WAIT_TIMEOUT):
+        await self._browser.watch_targets()
+        events = (await self._browser.browser_connection_async()).events
+        with events.subscribe('Target.targetDestroyed') as destroyed:
+            await self.close_async()
+            end_time = time.perf_counter() + timeout
+            while self.id in [x.id for x in await self._browser.pages_async()]:
+                event = await destroyed.get(max(0., end_time - time.perf_counter()))
+                if event['params']['targetId'] == self.id:
+                    return
 
     def activate(self):
-        requests.get(f'http://{self.address}/json/activate/{self.id}')
+        self._browser.http('GET', f'/json/activate/{self.id}')
+
+    async def activate_async(self):
+        await self._browser.http_async('GET', f'/json/activate/{self.id}')
 
     async def go_url(self, url: str, *, activate=False):
         await self.command_result('Page.navigate', COMMAND_TIMEOUT, url=url)
+        self._acquire_connection().domains.invalidate_document()
+        self.invalidate_node_contents()
         if activate:
-            self.activate()
+            await self.activate_async()
+
+    @contextlib.contextmanager
+    def timed_action(self, action: str):
+        # 记录组合操作的端到端耗时, 见 Browser.action_metrics
+        start, error = time.perf_counter(), True
+        try:
+            yield
+            error = False
+        finally:
+            self._browser.cdp_metrics.record_action(action, time.perf_counter() - start, error)
 
     async def command_result(self, command: str, timeout: float, **params) -> dict:
-        request_id = config.next_id()
-        request = {
-            'id': request_id,
-            'method': command,
-            'params': params
-        }
-        self._ensure_ws()
+        response = await (await self._ensure_ws()).request(command, params, timeout)
+        if response.get('error'):
+            raise CommandException(response.get('error'), params)
+        return response['result']
+
+    async def command_batch(self, commands: Sequence[tuple[str, dict]], timeout: float,
+                            return_exceptions=False) -> list:
+        # 连续写出全部命令后统一等待响应, N 次往返合并为一次
+        if not commands:
+            return []
+        connection = await self._ensure_ws()
+        sent = list[tuple[int, asyncio.Future]]()
         try:
-            self._ws.send(json.dumps(request))
-        except (BrokenPipeError, WebSocketException):
-            self._create_and_init_ws()
-            self._ws.send(json.dumps(request))
-        return await self._wait_response(request_id, timeout, params)
+            for command, params in commands:
+                sent.append(connection.send(command, params))
+            await asyncio.wait([future for _, future in sent], timeout=timeout)
+        finally:
+            for request_id, _ in sent:
+                connection.forget(request_id)
+        results = list()
+        for (command, params), (_, future) in zip(commands, sent):
+            if not future.done():
+                future.cancel()
+                result = TimeoutError(f'Timeout: {timeout}', params)
+            elif future.exception():
+                result = future.exception()
+            elif future.result().get('error'):
+                result = CommandException(future.result().get('error'), params)
+            else:
+                result = future.result()['result']
+            if isinstance(result, BaseException) and not return_exceptions:
+                raise result
+            results.append(result)
+        return results
+
+    async def enable_domain(self, domain: str, **params):
+        domains = (await self._ensure_ws()).domains
+        if domains.is_enabled(domain):
+            return
+        await self.command_result(f'{domain}.enable', COMMAND_TIMEOUT, **params)
+        domains.mark_enabled(domain, params)
 
-    async def _wait_response(self, request_id: int, timeout: float, params: dict) -> Any:
-        end_time = time.perf_counter() + timeout
-        while True:
-            try:
-                raw = self._recv(end_time - time.perf_counter())
-                data = json.loads(raw)
-                if isinstance(data, dict) and data.get('id') == request_id:
-                    if data.get('error'):
-                        raise CommandException(data.get('error'), params)
-                    return data['result']
-            except BlockingIOError:
-                pass
-            if end_time < time.perf_counter():
-                raise TimeoutError(f'Timeout: {timeout}', params)
-
-    async def _ensure_dom_enabled(self):
-        if PageFlag.DOM_ENABLED & self.page_flag:
+    async def disable_domain(self, domain: str):
+        domains = (await self._ensure_ws()).domains
+        if not domains.is_enabled(domain):
             return
-        await self.command_result('DOM.enable', COMMAND_TIMEOUT)
-        await self.command_result('DOM.getDocument', COMMAND_TIMEOUT)
+        domains.mark_disabled(domain)
+        await self.command_result(f'{domain}.disable', COMMAND_TIMEOUT)
+
+    async def _ensure_binding(self, name: str):
+        domains = (await self._ensure_ws()).domains
+        if name in domains.bindings:
+            return
+        await self.command_result('Runtime.addBinding', COMMAND_TIMEOUT, name=name)
+        domains.bindings.add(name)
+
+    async def _ensure_dom_enabled(self) -> int:
+        # 返回文档根节点的 nodeId
+        await self.enable_domain('DOM')
+        domains = (await self._ensure_ws()).domains
+        if domains.document_ready:
+            return domains.document_node_id
+        version = domains.document_version()
+        result = await self.command_result('DOM.getDocument', COMMAND_TIMEOUT)
+        domains.document_loaded(version, result['root']['nodeId'])
+        return result['root']['nodeId']
+
+    async def _evaluate_xpath(self, xpath: str, timeout: float) -> Optional[list[dict]]:
+        # 返回 None 表示页面内无法处理该表达式, 由调用方退回 DOM.performSearch
+        result = await self.command_result('Runtime.evaluate', timeout,
+                                           expression=f'{XPATH_QUERY_FUNCTION}({json.dumps(xpath)})',
+                                           silent=True, serializationOptions=NODE_LIST_SERIALIZATION)
+        if result.get('exceptionDetails'):
+            return None
+        serialized = result['result'].get('deepSerializedValue')
+        if not serialized:
+            self.in_page_queries = False
+            return None
+        return serialized_node_list(serialized)
+
+    def _nodes_for_xpath(self, xpath: str, data_list: list[dict]) -> list[PageNode]:
+        if len(data_list) == 1:
+            return [self.node(f'{xpath}', data_list[0])]
+        return [self.node(f'({xpath})[{i + 1}]', data) for i, data in enumerate(data_list)]
+
+    def node(self, x_path: str, data: dict, keep_path=False) -> PageNode:
+        # keep_path: 节点已缓存时保留其原有 xpath
+        self.sync_nodes()
+        backend_id = data['backendNodeId']
+        node = self._nodes.get(backend_id)
+        if node:
+            node._refresh('' if keep_path else x_path, data)
+        else:
+            node = self._nodes[backend_id] = PageNode(self, x_path, data)
+        if data.get('nodeId'):
+            self.bind_node_id(data['nodeId'], backend_id)
+        return node
 
-    async def _query_by_xpath(self, xpath: str, timeout: float) -> list[PageNode]:
+    def bind_node_id(self, node_id: int, backend_id: int):
+        self._node_ids[node_id] = backend_id
+
+    def _cached_node(self, node_id: Optional[int]) -> Optional[PageNode]:
+        backend_id = self._node_ids.get(node_id)
+        return self._nodes.get(backend_id) if backend_id else None
+
+    def sync_nodes(self):
+        # 在事件循环线程中消费积压的 DOM 变更, 按 nodeId 精确失效缓存节点的内容
+        connection = self._acquire_connection()
+        if self._mutations_bus is not connection.events or self._nodes_epoch != connection.epoch:
+            # 新连接上 objectId/nodeId 都已失效
+            self._reset_nodes()
+            if self._mutations:
+                self._mutations.close()
+            self._mutations = connection.events.subscribe(*DOM_MUTATION_EVENTS)
+            self._mutations_bus = connection.events
+            self._nodes_epoch = connection.epoch
+            return
+        dropped = self._mutations.dropped
+        for event in self._mutations.drain():
+            self._apply_mutation(event)
+        if self._mutations.dropped != dropped:
+            self.invalidate_node_contents()
+
+    def _reset_nodes(self):
+        for node in list(self._nodes.values()):
+            node._invalidate_identity()
+        self._nodes.clear()
+        self._node_ids.clear()
+
+    def invalidate_node_contents(self):
+        for node in list(self._nodes.values()):
+            node.invalidate_content()
+
+    def _apply_mutation(self, event: dict):
+        method, params = event['method'], event.get('params', {})
+        if method == 'DOM.documentUpdated':
+            self._reset_nodes()
+            return
+        if method == 'DOM.setChildNodes':
+            stack = list(params.get('nodes', []))
+            while stack:
+                data = stack.pop()
+                self.bind_node_id(data['nodeId'], data['backendNodeId'])
+                stack += data.get('children', [])
+            return
+        if method == 'DOM.childNodeRemoved':
+            removed = self._node_ids.pop(params['nodeId'], None)
+            removed_node = self._nodes.pop(removed, None) if removed else None
+            if removed_node:
+                removed_node._parent_node = None
+        node = self._cached_node(params.get('parentNodeId', params.get('nodeId')))
+        if not node:
+            # 变更发生在未缓存的节点上, 无法判断影响了哪些缓存节点的内容
+            self.invalidate_node_contents()
+            return
+        if method == 'DOM.attributeModified':
+            node._attributes[params['name']] = params['value']
+        elif method == 'DOM.attributeRemoved':
+            node._attributes.pop(params['name'], None)
+        elif method == 'DOM.childNodeCountUpdated':
+            node.child_count = params['childNodeCount']
+        while node:
+            node.invalidate_content()
+            node = node._parent_node
+
+    async def _query_by_xpath(self, xpath: str, timeout: float, with_pseudo=False) -> list[PageNode]:
+        # 需要伪元素时只能走 DOM.describeNode, 页面内查询拿不到伪元素的 backendNodeId
+        if self.in_page_queries and not with_pseudo:
+            data_list = await self._evaluate_xpath(xpath, timeout)
+            if data_list is not None:
+                return self._nodes_for_xpath(xpath, data_list)
+        return await self._search_by_xpath(xpath, timeout)
+
+    async def _search_by_xpath(self, xpath: str, timeout: float) -> list[PageNode]:
         await self._ensure_dom_enabled()
         result: dict = await self.command_result('DOM.performSearch', query=xpath,
                                                  includeUserAgentShadowDOM=True, timeout=timeout)
@@ -149,38 +411,46 @@ class BrowserPage:
                 return []
             result = await self.command_result('DOM.getSearchResults', COMMAND_TIMEOUT,
                                                searchId=search_id, fromIndex=0, toIndex=result_count)
-            node_ids = result['nodeIds']
+            node_ids = [x for x in result['nodeIds'] if x > 0]
             if not node_ids:
                 return []
-            data_list = list()
-            for _id in [x for x in node_ids if x > 0]:
-                result = await self.command_result('DOM.describeNode', COMMAND_TIMEOUT,
-                                                   nodeId=_id)
-                data_list.append(result['node'])
-            if len(data_list) == 1:
-                return [PageNode(self, f'{xpath}', **data_list[0])]
-            else:
-                return [PageNode(self, f'({xpath})[{i + 1}]', **data) for i, data in enumerate(data_list)]
+            commands = ([('DOM.describeNode', {'nodeId': _id}) for _id in node_ids]
+                        + [('DOM.discardSearchResults', {'searchId': search_id})])
+            # discard 随批量命令一起写出, 即使其中的 describeNode 失败也已发送, finally 中不再重复
+            search_id = None
+            results = await self.command_batch(commands, COMMAND_TIMEOUT)
+            return self._nodes_for_xpath(xpath, [x['node'] for x in results[:-1]])
         finally:
-            await self.command_result('DOM.discardSearchResults', COMMAND_TIMEOUT,
-                                      searchId=search_id)
+            if search_id:
+                await self.command_result('DOM.discardSearchResults', COMMAND_TIMEOUT,
+                                          searchId=search_id)
 
-    async def query_nodes_by_xpath(self, xpath: str, timeout: float) -> list[PageNode]:
+    async def _query_until(self, query: Callable[[float], Coroutine[Any, Any, list[PageNode]]],
+                           timeout: float) -> list[PageNode]:
         end_time = time.perf_counter() + timeout
         e: Optional[CommandException] = None
-        while True:
-            try:
-                nodes = await self._query_by_xpath(xpath, end_time - time.perf_counter())
-            except CommandException as e:
-                nodes = []
-            except TimeoutError:
-                if e:
-                    raise e
-                else:
-                    return []
-            if nodes or time.perf_counter() > end_time:
-                return nodes
-            await asyncio.sleep(NODE_FIND_LOOP_INTERVAL)
+        with self.events.subscribe(*DOM_MUTATION_EVENTS) as mutations:
+            while True:
+                try:
+                    # timeout 只限制等待节点出现的时长, 单次查询至少给足一个命令超时 (timeout=0 即只查一次)
+                    nodes = await query(max(COMMAND_TIMEOUT, end_time - time.perf_counter()))
+                except CommandException as e:
+                    nodes = []
+                except TimeoutError:
+                    if e:
+                        raise e
+                    else:
+                        return []
+                if nodes or time.perf_counter() > end_time:
+                    return nodes
+                # 页面内查询不依赖 DOM domain, 需要等待时才启用以便收到变更事件
+                await self._ensure_dom_enabled()
+                # DOM 有变化时立即重试, 未收到推送时最多等待一个轮询间隔
+                await mutations.wait_activity(min(NODE_FIND_LOOP_INTERVAL, end_time - time.perf_counter()))
+
+    async def query_nodes_by_xpath(self, xpath: str, timeout: float, with_pseudo=False) -> list[PageNode]:
+        return await self._query_until(lambda remaining: self._query_by_xpath(xpath, remaining, with_pseudo),
+                                       timeout)
 
     async def query_single_node_by_xpath(self, xpath: str, timeout: float) -> Optional[PageNode]:
         nodes = await self.query_nodes_by_xpath(xpath, timeout)
@@ -200,22 +470,183 @@ class BrowserPage:
             raise NodeNotFoundError(f'xpath={xpath}, timeout={timeout}')
         return node
 
+    async def _evaluate_css(self, selector: str, timeout: float) -> Optional[list[dict]]:
+        result = await self.command_result('Runtime.evaluate', timeout,
+                                           expression=f'{CSS_QUERY_FUNCTION}({json.dumps(selector)})',
+                                           silent=True, serializationOptions=NODE_PATH_SERIALIZATION)
+        if result.get('exceptionDetails'):
+            raise CommandException(result['exceptionDetails'], selector)
+        serialized = result['result'].get('deepSerializedValue')
+        if not serialized:
+            self.in_page_queries = False
+            return None
+        return serialized_node_paths(serialized)
+
+    async def _query_by_css(self, selector: str, timeout: float, with_pseudo=False) -> list[PageNode]:
+        if self.in_page_queries and not with_pseudo:
+            data_list = await self._evaluate_css(selector, timeout)
+            if data_list is not None:
+                return [self.node('', data) for data in data_list]
+        return await self._select_by_css(selector, timeout)
+
+    async def _select_by_css(self, selector: str, timeout: float) -> list[PageNode]:
+        # DOM.querySelectorAll 不带选择器路径, 结果解析为对象后一次 callFunctionOn 按值取回全部路径
+        root_id = await self._ensure_dom_enabled()
+        result = await self.command_result('DOM.querySelectorAll', timeout, nodeId=root_id, selector=selector)
+        node_ids = [x for x in result['nodeIds'] if x > 0]
+        if not node_ids:
+            return []
+        results = await self.command_batch([('DOM.describeNode', {'nodeId': _id}) for _id in node_ids],
+                                           COMMAND_TIMEOUT)
+        nodes = [self.node('', dict(x['node'], nodeId=_id)) for _id, x in zip(node_ids, results)]
+        await self.resolve_nodes(nodes)
+        result = await self.command_result('Runtime.callFunctionOn', COMMAND_TIMEOUT,
+                                           functionDeclaration=CSS_PATHS_FUNCTION,
+                                           objectId=nodes[0]._object['objectId'], returnByValue=True,
+                                           arguments=[{'objectId': x._object['objectId']} for x in nodes])
+        if result.get('exceptionDetails'):
+            raise CommandException(result['exceptionDetails'], selector)
+        for node, path in zip(nodes, result['result']['value']):
+            node.css_path = path
+        return nodes
+
+    async def query_nodes_by_css(self, selector: str, timeout: float, with_pseudo=False) -> list[PageNode]:
+        return await self._query_until(lambda remaining: self._query_by_css(selector, remaining, with_pseudo),
+                                       timeout)
+
+    async def query_single_node_by_css(self, selector: str, timeout: float) -> Optional[PageNode]:
+        nodes = await self.query_nodes_by_css(selector, timeout)
+        if len(nodes) > 1:
+            raise TooMuchNodeError(f'selector: {selector}, len: {len(nodes)}')
+        return nodes[0] if nodes else None
+
+    async def require_nodes_by_css(self, selector: str, timeout: float) -> list[PageNode]:
+        nodes = await self.query_nodes_by_css(selector, timeout)
+        if not nodes:
+            raise NodeNotFoundError(f'selector={selector}, timeout={timeout}')
+        return nodes
+
+    async def require_single_node_by_css(self, selector: str, timeout: float) -> PageNode:
+        node = await self.query_single_node_by_css(selector, timeout)
+        if not node:
+            raise NodeNotFoundError(f'selector={selector}, timeout={timeout}')
+        return node
+
+    async def _install_wait(self, options: dict, end_time: float):
+        # 重新安装时页面内只给截止时间前剩余的时长, 而不是整个 timeout
+        options = dict(options, timeout=max(0., end_time - time.perf_counter()) * 1000)
+        result = await self.command_result('Runtime.evaluate', COMMAND_TIMEOUT,
+                                           expression=f'{WAIT_FOR_FUNCTION}({json.dumps(options)})', silent=True)
+        if result.get('exceptionDetails'):
+            raise CommandException(result['exceptionDetails'], options['query'])
+
+    async def wait_for(self, *, xpath='', css='', state=WaitState.ATTACHED, timeout: float = WAIT_FOR_TIMEOUT,
+                       settle: float = TEXT_STABLE_INTERVAL) -> list[PageNode]:
+        # 由页面内的 MutationObserver 在满足条件的那次变更上回调, 等待期间没有轮询请求
+        # 返回满足条件时匹配的节点, DETACHED 返回空列表; 超时抛出 TimeoutError
+        if bool(xpath) == bool(css):
+            raise ValueError('Exactly one of xpath and css is required', xpath, css)
+        await self.enable_domain('Runtime')
+        await self._ensure_binding(WAIT_BINDING)
+        options = {'binding': WAIT_BINDING, 'id': uuid.uuid4().hex, 'kind': 'css' if css else 'xpath',
+                   'query': css or xpath, 'state': state.value, 'settle': settle * 1000}
+        end_time = time.perf_counter() + timeout
+        with self.events.subscribe('Runtime.bindingCalled', 'Runtime.executionContextCreated') as events:
+            await self._install_wait(options, end_time)
+            while True:
+                try:
+                    event = await events.get(max(0., end_time - time.perf_counter()))
+                except TimeoutError:
+                    raise TimeoutError(f'Timeout: {timeout}', options['query'], state)
+                params = event.get('params', {})
+                if event['method'] == 'Runtime.executionContextCreated':
+                    # 主 frame 导航后 observer 随旧文档一起失效, 在新文档上重新安装
+                    aux_data = params.get('context', {}).get('auxData', {})
+                    if aux_data.get('isDefault') and aux_data.get('frameId') == self.id:
+                        await self._install_wait(options, end_time)
+                    continue
+                if params.get('name') != WAIT_BINDING or params.get('payload') != options['id']:
+                    continue
+                if state == WaitState.DETACHED:
+                    return []
+                nodes = await (self._query_by_css(css, COMMAND_TIMEOUT) if css
+                               else self._query_by_xpath(xpath, COMMAND_TIMEOUT))
+                if nodes:
+                    return nodes
+                # 回调之后节点又被移除, 继续等待
+                await self._install_wait(options, end_time)
+
+    async def resolve_nodes(self, nodes: Sequence[PageNode]):
+        # 未解析 objectId 的节点合并为一批 DOM.resolveNode
+        missing = [x for x in nodes if not x._object]
+        results = await self.command_batch([('DOM.resolveNode', {'backendNodeId': x.backend_id}) for x in missing],
+                                           COMMAND_TIMEOUT)
+        for node, result in zip(missing, results):
+            node._object = result['object']
+
+    async def set_nodes_props(self, nodes: Sequence[PageNode], kv_dict: Optional[dict] = None,
+                              **kwargs) -> list[dict]:
+        # 一次 callFunctionOn 设置全部节点的属性 (值为 None 时删除), 返回并同步各节点更新后的属性
+        if not nodes:
+            return []
+        kv_dict = dict(**kv_dict) if kv_dict else dict()
+        kv_dict.update(kwargs)
+        await self.resolve_nodes(nodes)
+        result = await self.command_result('Runtime.callFunctionOn', COMMAND_TIMEOUT,
+                                           functionDeclaration=SET_ATTRIBUTES_FUNCTION,
+                                           objectId=nodes[0]._object['objectId'], returnByValue=True,
+                                           arguments=[{'value': kv_dict}]
+                                                     + [{'objectId': x._object['objectId']} for x in nodes])
+        e = result.get('exceptionDetails')
+        if e:
+            raise JsExecuteException(e)
+        attributes_list: list[dict] = result['result']['value']
+        for node, attributes in zip(nodes, attributes_list):
+            node._attributes = dict(attributes)
+            node.invalidate_content()
+        return attributes_list
+
+    async def capture_snapshot(self, timeout: float = SNAPSHOT_TIMEOUT) -> DomSnapshot:
+        result = await self.command_result('DOMSnapshot.captureSnapshot', timeout, computedStyles=[])
+        return DomSnapshot(result)
+
+    async def require_snapshot(self, xpaths: Sequence[str], timeout: float,
+                               selectors: Sequence[str] = ()) -> DomSnapshot:
+        # 等到快照中每个 xpath/选择器都有匹配节点, 之后的读取都在本地快照上完成
+        end_time = time.perf_counter() + timeout
+        with self.events.subscribe(*DOM_MUTATION_EVENTS) as mutations:
+            while True:
+                snapshot = await self.capture_snapshot(max(SNAPSHOT_TIMEOUT, end_time - time.perf_counter()))
+                missing = ([x for x in xpaths if not snapshot.query_xpath(x)]
+                           + [x for x in selectors if not snapshot.query_css(x)])
+                if not missing:
+                    return snapshot
+                if time.perf_counter() > end_time:
+                    raise NodeNotFoundError(f'missing={missing}, timeout={timeout}')
+                await self._ensure_dom_enabled()
+                await mutations.wait_activity(min(NODE_FIND_LOOP_INTERVAL, end_time - time.perf_counter()))
+
+    def snapshot_node(self, snapshot: DomSnapshot, node: int) -> PageNode:
+        # 快照节点按 backendNodeId 绑定到页面上的活动节点, 需要点击等操作时使用
+        data = snapshot.describe(node)
+        if snapshot.is_element(node):
+            data['cssPath'] = snapshot.css_path(node)
+        return self.node(snapshot.xpath(node), data, keep_path=True)
+
     async def run_js(self, expression: str, timeout: float):
         return await self.command_result('Runtime.evaluate', timeout,
                                          expression=expression)
 
     def __del__(self):
-        if self._ws:
-            self._ws.close()
+        self.close_connection()
 
     def close_connection(self):
-        if self._ws:
-            try:
-                self._ws.close()
-                self._ws.ping()
-                self._ws = None
-            except WebSocketException:
-                pass
+        mutations, self._mutations, self._mutations_bus = self._mutations, None, None
+        if mutations:
+            mutations.close()
+        connection, self._connection = self._connection, None
+        if connection:
+            self._pool.release(self.id, connection)
 
 
 def main():
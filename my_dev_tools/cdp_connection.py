@@ -0,0 +1,444 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from typing import Callable, Optional
+
+import websocket
+from websocket import ABNF, WebSocket, WebSocketException
+
+from . import config
+from .cdp_domains import DomainState
+from .cdp_events import EventBus
+from .cdp_metrics import CdpMetrics
+
+CONNECTION_TIMEOUT = 5
+ABANDONED_HISTORY_SIZE = 256
+HEALTH_CHECK_IDLE = 10
+IDLE_CONNECTION_TTL = 60
+ATTACH_TIMEOUT = 5
+# 只扫描帧首尾判断类别: 响应以 id 开头, 事件以 method 开头, flatten session 的 sessionId 位于末尾
+FRAME_TAIL_SIZE = 128
+_RESPONSE_HEAD = re.compile(rb'\s*\{\s*"id"\s*:\s*(\d+)')
+_EVENT_HEAD = re.compile(rb'\s*\{\s*"method"\s*:\s*"([^"\\]+)"')
+_SESSION_TAIL = re.compile(rb'"sessionId"\s*:\s*"([^"\\]+)"\s*\}\s*$')
+# 这些事件即使无人订阅也要解码, 连接自身依赖它们维护 session 状态
+_CONTROL_EVENTS = frozenset(['Target.detachedFromTarget'])
+
+
+class ConnectionClosedError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
+class _PendingCommand:
+    def __init__(self, loop: asyncio.AbstractEventLoop, future: asyncio.Future, method: str):
+        self.loop = loop
+        self.future = future
+        self.method = method
+        self.ws: Optional[WebSocket] = None
+        self.start = time.perf_counter()
+
+
+def _resolve(future: asyncio.Future, message: dict):
+    if not future.done():
+        future.set_result(message)
+
+
+def _reject(future: asyncio.Future, e: BaseException):
+    if not future.done():
+        future.set_exception(e)
+
+
+def _encode(request_id: int, method: str, params: dict, session_id: Optional[str]) -> str:
+    request = {'id': request_id, 'method': method, 'params': params}
+    if session_id:
+        request['sessionId'] = session_id
+    return json.dumps(request)
+
+
+def _call_soon_threadsafe(loop: asyncio.AbstractEventLoop, callback, *args):
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        # 事件循环已关闭, 等待方已不存在
+        pass
+
+
+class CdpConnection:
+    def __init__(self, websocket_url: str, events: Optional[EventBus] = None,
+                 metrics: Optional[CdpMetrics] = None):
+        self.websocket_url = websocket_url
+        self.events = events if events else EventBus()
+        self.metrics = metrics if metrics else CdpMetrics()
+        self._ws: Optional[WebSocket] = None
+        self._reader: Optional[threading.Thread] = None
+        self._connect_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = dict[int, _PendingCommand]()
+        # 已超时放弃的请求, 用于把迟到的响应记到对应方法上
+        self._abandoned = dict[int, str]()
+        self._last_received = 0.
+        # 最近一次发送命令的时间, 连接池据此关闭长时间不用的连接
+        self.last_used = time.perf_counter()
+        # flatten 模式下各 target session 的事件总线, 以 sessionId 区分
+        self._sessions = dict[str, EventBus]()
+        # 每次建立新的 websocket 递增, 浏览器端 domain 状态随旧连接失效
+        self.epoch = 0
+        self.domains = DomainState(self.events)
+
+    @property
+    def connected(self) -> bool:
+        return bool(self._ws and self._ws.connected and self._reader and self._reader.is_alive())
+
+    def healthy(self) -> bool:
+        if not self.connected:
+            return False
+        if time.perf_counter() - self._last_received < HEALTH_CHECK_IDLE:
+            return True
+        # 长时间没有收到消息时才探测, 发送 ping 失败说明连接已断开
+        try:
+            with self._send_lock:
+                self._ws.ping()
+            return True
+        except (WebSocketException, OSError, AttributeError):
+            return False
+
+    def connect(self):
+        with self._connect_lock:
+            if not self.connected:
+                self._open()
+
+    def _open(self):
+        ws: WebSocket = websocket.create_connection(self.websocket_url, CONNECTION_TIMEOUT)
+        self._last_received = time.perf_counter()
+        self._sessions.clear()
+        self.epoch += 1
+        # 读线程阻塞等待消息, 关闭连接时由 abort 唤醒
+        ws.settimeout(None)
+        self._ws = ws
+        self._reader = threading.Thread(target=self._read_loop, args=(ws,),
+                                        name=f'cdp-reader {self.websocket_url}', daemon=True)
+        self._reader.start()
+
+    def _reopen(self):
+        # 并发的调用方排队重连, 只有第一个真正关闭并重建连接, 其余复用, 不打断已发出的请求
+        with self._connect_lock:
+            if self.healthy():
+                return
+            self.close()
+            self._open()
+
+    async def ensure_open(self):
+        # 握手最长阻塞 CONNECTION_TIMEOUT 秒, 放到线程中进行, 不占用事件循环
+        if not self.healthy():
+            await asyncio.get_running_loop().run_in_executor(None, self._reopen)
+
+    def register_session(self, session_id: str, events: EventBus):
+        self._sessions[session_id] = events
+
+    def unregister_session(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    def has_session(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def close(self):
+        ws, self._ws = self._ws, None
+        self._sessions.clear()
+        if not ws:
+            return
+        try:
+            with self._send_lock:
+                ws.send_close()
+        except (WebSocketException, OSError):
+            pass
+        ws.abort()
+
+    def send(self, method: str, params: dict, session_id: Optional[str] = None) -> (int, asyncio.Future):
+        loop = asyncio.get_running_loop()
+        self.last_used = time.perf_counter()
+        request_id = config.next_id()
+        future = loop.create_future()
+        pending = _PendingCommand(loop, future, method)
+        with self._pending_lock:
+            self._pending[request_id] = pending
+        message = _encode(request_id, method, params, session_id)
+        self.metrics.record_request(method, len(message))
+        try:
+            pending.ws = self._send_text(message)
+        except (BrokenPipeError, WebSocketException, ConnectionClosedError):
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            raise ConnectionClosedError(self.websocket_url, method, session_id)
+        return request_id, future
+
+    def send_nowait(self, method: str, params: dict, session_id: Optional[str] = None):
+        try:
+            self._send_text(_encode(config.next_id(), method, params, session_id))
+        except (BrokenPipeError, WebSocketException, ConnectionClosedError):
+            pass
+
+    def _send_text(self, message: str) -> WebSocket:
+        # 不在此处重连: 调用方在事件循环上, 需先 await ensure_open
+        with self._send_lock:
+            ws = self._ws
+            if not ws or not self.connected:
+                raise ConnectionClosedError(self.websocket_url)
+            ws.send(message)
+        return ws
+
+    async def request(self, method: str, params: dict, timeout: float, session_id: Optional[str] = None) -> dict:
+        try:
+            request_id, future = self.send(method, params, session_id)
+        except ConnectionClosedError:
+            if session_id:
+                # 重连后原 session 已失效, 需由 CdpSession 重新 attach
+                raise
+            await self.ensure_open()
+            request_id, future = self.send(method, params, session_id)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'Timeout: {timeout}', params)
+        finally:
+            self.forget(request_id)
+
+    def forget(self, request_id: int):
+        with self._pending_lock:
+            pending = self._pending.pop(request_id, None)
+            if pending:
+                self._abandoned[request_id] = pending.method
+                while len(self._abandoned) > ABANDONED_HISTORY_SIZE:
+                    del self._abandoned[next(iter(self._abandoned))]
+        if pending:
+            self.metrics.record_timeout(pending.method, time.perf_counter() - pending.start)
+
+    def _read_loop(self, ws: WebSocket):
+        try:
+            while True:
+                opcode, data = ws.recv_data(control_frame=True)
+                self._last_received = time.perf_counter()
+                if opcode == ABNF.OPCODE_CLOSE:
+                    break
+                if opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
+                    self._dispatch(data)
+        except (WebSocketException, OSError, ValueError):
+            pass
+        finally:
+            ws.shutdown()
+            self._fail_pending(ws)
+
+    def _dispatch(self, raw: bytes):
+        # 先用正则粗分帧, 只有挂起的请求或有订阅者的事件才完整 json 解码
+        size = len(raw)
+        head = _RESPONSE_HEAD.match(raw)
+        if head:
+            request_id = int(head.group(1))
+            with self._pending_lock:
+                pending = self._pending.pop(request_id, None)
+                abandoned_method = self._abandoned.pop(request_id, None) if not pending else None
+            if pending:
+                message = json.loads(raw)
+                self.metrics.record_response(pending.method, time.perf_counter() - pending.start, size,
+                                             error='error' in message)
+                _call_soon_threadsafe(pending.loop, _resolve, pending.future, message)
+            elif abandoned_method:
+                self.metrics.record_dropped(abandoned_method, size, skipped=True)
+            return
+        head = _EVENT_HEAD.match(raw)
+        if head:
+            method = head.group(1).decode('utf-8')
+            tail = _SESSION_TAIL.search(raw, max(0, size - FRAME_TAIL_SIZE))
+            if not tail and self._sessions and b'"sessionId"' in raw:
+                self._dispatch_message(json.loads(raw), size)
+                return
+            session_id = tail.group(1).decode('utf-8') if tail else None
+            events = self._sessions.get(session_id) if session_id else self.events
+            if method not in _CONTROL_EVENTS and (not events or not events.has_subscriber(method)):
+                self.metrics.record_dropped(method, size, skipped=True)
+                return
+        self._dispatch_message(json.loads(raw), size)
+
+    def _dispatch_message(self, message, size: int):
+        if not isinstance(message, dict):
+            return
+        if 'id' not in message:
+            method = message.get('method')
+            if not method:
+                return
+            if method == 'Target.detachedFromTarget':
+                self.unregister_session(message.get('params', {}).get('sessionId'))
+            events = self._sessions.get(message['sessionId']) if 'sessionId' in message else self.events
+            if not events or not events.has_subscriber(method):
+                self.metrics.record_dropped(method, size)
+            if events:
+                events.publish(message)
+            return
+        with self._pending_lock:
+            pending = self._pending.pop(message['id'], None)
+            abandoned_method = self._abandoned.pop(message['id'], None) if not pending else None
+        if pending:
+            self.metrics.record_response(pending.method, time.perf_counter() - pending.start, size,
+                                         error='error' in message)
+            _call_soon_threadsafe(pending.loop, _resolve, pending.future, message)
+        elif abandoned_method:
+            self.metrics.record_dropped(abandoned_method, size)
+
+    def _fail_pending(self, ws: WebSocket):
+        with self._pending_lock:
+            pending_list = [x for x in self._pending.values() if x.ws is ws]
+            self._pending = {k: v for k, v in self._pending.items() if v.ws is not ws}
+        for pending in pending_list:
+            e = ConnectionClosedError(self.websocket_url, pending.method)
+            _call_soon_threadsafe(pending.loop, _reject, pending.future, e)
+
+
+class CdpSession:
+    # 通过浏览器级连接 attach 到某个 target (flatten=true), 对外接口与 CdpConnection 一致
+    def __init__(self, connection: CdpConnection, target_id: str, websocket_url: str = ''):
+        self.connection = connection
+        self.target_id = target_id
+        self.websocket_url = websocket_url
+        self.events = EventBus()
+        self.metrics = connection.metrics
+        self.session_id: Optional[str] = None
+        self.epoch = 0
+        self.domains = DomainState(self.events)
+        self.last_used = time.perf_counter()
+        self._attach_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def connected(self) -> bool:
+        return bool(self.session_id) and self.connection.connected and self.connection.has_session(self.session_id)
+
+    def healthy(self) -> bool:
+        return self.connected and self.connection.healthy()
+
+    async def ensure_open(self):
+        if self.healthy():
+            return
+        if not self._attach_lock:
+            self._attach_lock = asyncio.Lock()
+        async with self._attach_lock:
+            if self.healthy():
+                return
+            await self.connection.ensure_open()
+            response = await self.connection.request('Target.attachToTarget',
+                                                     {'targetId': self.target_id, 'flatten': True}, ATTACH_TIMEOUT)
+            if 'error' in response:
+                raise ConnectionClosedError(self.target_id, response['error'])
+            self.session_id = response['result']['sessionId']
+            self.epoch += 1
+            self.connection.register_session(self.session_id, self.events)
+
+    def send(self, method: str, params: dict) -> (int, asyncio.Future):
+        if not self.connected:
+            raise ConnectionClosedError(self.target_id, method)
+        self.last_used = time.perf_counter()
+        return self.connection.send(method, params, self.session_id)
+
+    def send_nowait(self, method: str, params: dict):
+        if self.connected:
+            self.connection.send_nowait(method, params, self.session_id)
+
+    async def request(self, method: str, params: dict, timeout: float) -> dict:
+        if not self.connected:
+            raise ConnectionClosedError(self.target_id, method)
+        self.last_used = time.perf_counter()
+        return await self.connection.request(method, params, timeout, self.session_id)
+
+    def forget(self, request_id: int):
+        self.connection.forget(request_id)
+
+    def close(self):
+        session_id, self.session_id = self.session_id, None
+        if session_id and self.connection.has_session(session_id):
+            self.connection.unregister_session(session_id)
+            self.connection.send_nowait('Target.detachFromTarget', {'sessionId': session_id})
+
+
+class _PoolEntry:
+    def __init__(self, connection: CdpConnection | CdpSession):
+        self.connection = connection
+        self.refs = 0
+        self.idle_since = 0.
+
+
+class ConnectionPool:
+    # 每个 target 只保留一条连接, 按引用计数共享; 超过 idle_ttl 秒没有发送命令的连接由后台线程关闭
+    def __init__(self, metrics: Optional[CdpMetrics] = None, idle_ttl: float = IDLE_CONNECTION_TTL,
+                 browser_connection: Optional[Callable[[], CdpConnection]] = None):
+        self.metrics = metrics
+        self.idle_ttl = idle_ttl
+        # 提供浏览器级连接时, 各 target 通过 flatten session 复用这一条连接
+        self.browser_connection = browser_connection
+        self._lock = threading.Lock()
+        self._entries = dict[str, _PoolEntry]()
+        self._reaper: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+
+    def _create(self, target_id: str, websocket_url: str) -> CdpConnection | CdpSession:
+        if self.browser_connection:
+            return CdpSession(self.browser_connection(), target_id, websocket_url)
+        return CdpConnection(websocket_url, metrics=self.metrics)
+
+    def acquire(self, target_id: str, websocket_url: str) -> CdpConnection | CdpSession:
+        stale = None
+        with self._lock:
+            entry = self._entries.get(target_id)
+            if entry and entry.connection.websocket_url != websocket_url:
+                stale = self._entries.pop(target_id)
+                entry = None
+            if not entry:
+                entry = self._entries[target_id] = _PoolEntry(self._create(target_id, websocket_url))
+            entry.refs += 1
+            if not self._reaper:
+                self._reaper = threading.Thread(target=self._reap_idle, name='cdp-connection-reaper', daemon=True)
+                self._reaper.start()
+        if stale:
+            stale.connection.close()
+        return entry.connection
+
+    def release(self, target_id: str, connection: CdpConnection | CdpSession):
+        with self._lock:
+            entry = self._entries.get(target_id)
+            if not entry or entry.connection is not connection:
+                return
+            entry.refs = max(0, entry.refs - 1)
+            if not entry.refs:
+                entry.idle_since = time.perf_counter()
+
+    def _reap_idle(self):
+        while not self._closed.wait(min(self.idle_ttl, HEALTH_CHECK_IDLE)):
+            expire = time.perf_counter() - self.idle_ttl
+            with self._lock:
+                idle = [(k, v) for k, v in self._entries.items()
+                        if max(v.idle_since, v.connection.last_used) < expire]
+                # 无人引用的移出连接池; 仍被 BrowserPage 持有的只关闭连接, 下次使用时由 ensure_open 重连
+                for target_id, entry in idle:
+                    if not entry.refs:
+                        del self._entries[target_id]
+                closing = [v.connection for _, v in idle if not v.refs or v.connection.connected]
+            for connection in closing:
+                connection.close()
+
+    def discard(self, target_id: str):
+        with self._lock:
+            entry = self._entries.pop(target_id, None)
+        if entry:
+            entry.connection.close()
+
+    def close_all(self):
+        for target_id in list(self._entries.keys()):
+            self.discard(target_id)
+
+    def close(self):
+        # 连接池被替换或不再使用时调用, 同时结束后台回收线程
+        self._closed.set()
+        self.close_all()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,67 @@
+import threading
+from typing import Optional
+
+from .cdp_events import EventBus
+
+DOCUMENT_EVENTS = ('DOM.documentUpdated', 'Page.frameNavigated')
+
+
+class DomainState:
+    # 记录一条连接 (或 session) 上已启用的 domain 与 DOM.getDocument 的缓存状态
+    # epoch 与连接的 epoch 不一致说明连接已重建, 浏览器端的 domain 状态已丢失, 需要按启用顺序重放
+    def __init__(self, events: EventBus):
+        self.enabled = dict[str, dict]()
+        # Runtime.addBinding 注册过的名字, 新连接上需要重新注册
+        self.bindings = set[str]()
+        self.epoch = -1
+        self._lock = threading.Lock()
+        self._document_version = 0
+        self._document_loaded: Optional[int] = None
+        # getDocument 返回的根节点 nodeId, DOM.querySelector* 以它为查询起点
+        self.document_node_id = 0
+        events.add_listener(self._on_document_event, *DOCUMENT_EVENTS)
+
+    def _on_document_event(self, event: dict):
+        frame = event.get('params', {}).get('frame')
+        if frame and frame.get('parentId'):
+            # 子 frame 导航不影响主文档
+            return
+        self.invalidate_document()
+
+    def is_enabled(self, domain: str) -> bool:
+        return domain in self.enabled
+
+    def mark_enabled(self, domain: str, params: dict):
+        self.enabled[domain] = params
+
+    def mark_disabled(self, domain: str):
+        self.enabled.pop(domain, None)
+
+    def stale(self, epoch: int) -> bool:
+        return self.epoch != epoch
+
+    def reset(self, epoch: int) -> list[tuple[str, dict]]:
+        # 返回需要在新连接上重放的 domain
+        self.epoch = epoch
+        self.bindings.clear()
+        self.invalidate_document()
+        return list(self.enabled.items())
+
+    @property
+    def document_ready(self) -> bool:
+        return self._document_loaded == self._document_version
+
+    def document_version(self) -> int:
+        return self._document_version
+
+    def document_loaded(self, version: int, node_id: int = 0):
+        # 请求 getDocument 期间若文档又被更新, version 已过期, 不能标记为可用
+        with self._lock:
+            if version == self._document_version:
+                self._document_loaded = version
+                self.document_node_id = node_id
+
+    def invalidate_document(self):
+        with self._lock:
+            self._document_version += 1
+
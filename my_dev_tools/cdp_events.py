@@ -0,0 +1,138 @@
+import asyncio
+import collections
+import threading
+import time
+from typing import Optional, Callable
+
+EVENT_QUEUE_SIZE = 256
+WAIT_EVENT_TIMEOUT = 5
+
+
+def _match(pattern: str, method: str) -> bool:
+    if pattern.endswith('.*'):
+        return method.startswith(pattern[:-1])
+    return pattern == method
+
+
+class EventSubscription:
+    def __init__(self, bus: "EventBus", methods: tuple[str, ...], maxsize: int):
+        self._bus = bus
+        self.methods = methods
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._loop = asyncio.get_running_loop()
+        self._queue = collections.deque[dict]()
+        self._waiter: Optional[asyncio.Future] = None
+
+    def matches(self, method: str) -> bool:
+        return any(_match(x, method) for x in self.methods)
+
+    def _push(self, event: dict):
+        if len(self._queue) >= self.maxsize:
+            self._queue.popleft()
+            self.dropped += 1
+            self._bus.dropped += 1
+        self._queue.append(event)
+        if self._waiter and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def get_nowait(self) -> Optional[dict]:
+        return self._queue.popleft() if self._queue else None
+
+    def drain(self) -> list[dict]:
+        events = list(self._queue)
+        self._queue.clear()
+        return events
+
+    async def get(self, timeout: Optional[float] = None) -> dict:
+        if not self._queue:
+            self._waiter = self._loop.create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f'Timeout: {timeout}', self.methods)
+            finally:
+                self._waiter = None
+        return self._queue.popleft()
+
+    async def wait_activity(self, timeout: float, settle: float = 0) -> bool:
+        # 等到有事件到达; settle > 0 时继续等到事件平息 settle 秒, 总时长不超过 timeout
+        end_time = time.perf_counter() + timeout
+        received = False
+        while True:
+            remaining = end_time - time.perf_counter()
+            if remaining <= 0:
+                return received
+            try:
+                await self.get(min(settle, remaining) if received else remaining)
+                received = True
+                self.drain()
+            except TimeoutError:
+                return received
+            if not settle:
+                return received
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+    def __enter__(self) -> "EventSubscription":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class EventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = list[EventSubscription]()
+        self._listeners = list[tuple[tuple[str, ...], Callable[[dict], None]]]()
+        self.received = 0
+        self.dropped = 0
+
+    def subscribe(self, *methods: str, maxsize=EVENT_QUEUE_SIZE) -> EventSubscription:
+        subscription = EventSubscription(self, methods, maxsize)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: EventSubscription):
+        with self._lock:
+            self._subscriptions = [x for x in self._subscriptions if x is not subscription]
+
+    def add_listener(self, callback: Callable[[dict], None], *methods: str):
+        # 监听器在发布事件的线程 (通常是连接的读线程) 中同步调用, 只适合维护缓存这类轻量操作
+        with self._lock:
+            self._listeners = self._listeners + [(methods, callback)]
+
+    def remove_listener(self, callback: Callable[[dict], None]):
+        with self._lock:
+            self._listeners = [x for x in self._listeners if x[1] is not callback]
+
+    def has_subscriber(self, method: str) -> bool:
+        return (any(x.matches(method) for x in self._subscriptions)
+                or any(_match(x, method) for methods, _ in self._listeners for x in methods))
+
+    def publish(self, event: dict):
+        # 可能在连接的读线程中调用, 事件交由订阅方所在的事件循环入队
+        self.received += 1
+        method = event.get('method', '')
+        for methods, callback in self._listeners:
+            if any(_match(x, method) for x in methods):
+                callback(event)
+        for subscription in self._subscriptions:
+            if subscription.matches(method):
+                try:
+                    subscription._loop.call_soon_threadsafe(subscription._push, event)
+                except RuntimeError:
+                    self.unsubscribe(subscription)
+
+    async def wait_for_event(self, method: str, predicate: Optional[Callable[[dict], bool]] = None,
+                             timeout: float = WAIT_EVENT_TIMEOUT) -> dict:
+        end_time = time.perf_counter() + timeout
+        with self.subscribe(method) as subscription:
+            while True:
+                event = await subscription.get(max(0., end_time - time.perf_counter()))
+                params = event.get('params', {})
+                if not predicate or predicate(params):
+                    return params
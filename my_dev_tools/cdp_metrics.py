@@ -0,0 +1,139 @@
+import collections
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from . import config
+
+LATENCY_SAMPLE_SIZE = 1024
+QUANTILES = (.5, .95, .99)
+
+
+class MethodMetrics:
+    def __init__(self, method: str):
+        self.method = method
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.dropped = 0
+        self.skipped_bytes = 0
+        self._latencies = collections.deque[float](maxlen=LATENCY_SAMPLE_SIZE)
+
+    def snapshot(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def _quantile(q: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            'dropped': self.dropped,
+            'skipped_bytes': self.skipped_bytes,
+            'latency': {f'p{int(q * 100)}': _quantile(q) for q in QUANTILES},
+        }
+
+
+class CdpMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = dict[str, MethodMetrics]()
+        # 组合操作 (click/hover/type_and_submit 等) 的端到端耗时, 与单条命令分开统计
+        self._actions = dict[str, MethodMetrics]()
+
+    def _method(self, method: str) -> MethodMetrics:
+        metrics = self._methods.get(method)
+        if not metrics:
+            metrics = self._methods[method] = MethodMetrics(method)
+        return metrics
+
+    def record_request(self, method: str, size: int):
+        with self._lock:
+            metrics = self._method(method)
+            metrics.count += 1
+            metrics.request_bytes += size
+
+    def record_response(self, method: str, latency: float, size: int, error=False):
+        with self._lock:
+            metrics = self._method(method)
+            metrics.response_bytes += size
+            metrics.errors += 1 if error else 0
+            metrics._latencies.append(latency)
+
+    def record_timeout(self, method: str, latency: float):
+        with self._lock:
+            metrics = self._method(method)
+            metrics.timeouts += 1
+            metrics._latencies.append(latency)
+
+    def record_dropped(self, method: str, size: int = 0, skipped=False):
+        # skipped: 帧未经 json 解码即被丢弃
+        with self._lock:
+            metrics = self._method(method)
+            metrics.dropped += 1
+            metrics.response_bytes += size
+            metrics.skipped_bytes += size if skipped else 0
+
+    def record_action(self, action: str, latency: float, error=False):
+        with self._lock:
+            metrics = self._actions.get(action)
+            if not metrics:
+                metrics = self._actions[action] = MethodMetrics(action)
+            metrics.count += 1
+            metrics.errors += 1 if error else 0
+            metrics._latencies.append(latency)
+
+    def snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: metrics.snapshot() for name, metrics in sorted(self._methods.items())}
+
+    def action_snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: {'count': metrics.count, 'errors': metrics.errors,
+                           'latency': metrics.snapshot()['latency']} for name, metrics in sorted(self._actions.items())}
+
+    def reset(self):
+        with self._lock:
+            self._methods.clear()
+            self._actions.clear()
+
+
+def to_prometheus(snapshot: dict[str, dict]) -> str:
+    counters = [('cdp_commands_total', 'count'), ('cdp_command_errors_total', 'errors'),
+                ('cdp_command_timeouts_total', 'timeouts'), ('cdp_request_bytes_total', 'request_bytes'),
+                ('cdp_response_bytes_total', 'response_bytes'), ('cdp_dropped_messages_total', 'dropped'),
+                ('cdp_skipped_bytes_total', 'skipped_bytes')]
+    lines = list[str]()
+    for metric_name, key in counters:
+        lines.append(f'# TYPE {metric_name} counter')
+        lines += [f'{metric_name}{{method="{method}"}} {data[key]}' for method, data in snapshot.items()]
+    lines.append('# TYPE cdp_command_latency_seconds summary')
+    for method, data in snapshot.items():
+        for q in QUANTILES:
+            value = data['latency'][f'p{int(q * 100)}']
+            if value is not None:
+                lines.append(f'cdp_command_latency_seconds{{method="{method}",quantile="{q}"}} {value:.6f}')
+    return '\n'.join(lines) + '\n'
+
+
+def export_metrics(snapshot: dict[str, dict], fmt='json', path: Optional[str] = None) -> str:
+    if fmt not in ('json', 'prometheus'):
+        raise ValueError(f'Unsupported metrics format: {fmt}')
+    if not path:
+        suffix = 'json' if fmt == 'json' else 'prom'
+        path = os.path.join(config.metrics_data_dir(), f'cdp_metrics_{time.strftime("%Y%m%d_%H%M%S")}.{suffix}')
+    with open(path, 'w', encoding='utf-8') as f:
+        if fmt == 'json':
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+        else:
+            f.write(to_prometheus(snapshot))
+    return path
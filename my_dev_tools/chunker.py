@@ -0,0 +1,77 @@
+import asyncio
+import re
+from typing import AsyncIterator, Iterator
+
+from .tokenizer import TokenCountMode, count_tokens
+
+CONTEXT_TOKEN_LIMIT = 4096
+# 每批计数的段落数: 合并编码, 又不必在产出第一块前数完整篇文章
+COUNT_BATCH_SIZE = 64
+# 句末标点之后切分, 紧跟的右引号/括号留在本句; 英文句号要求后面是空白, 避免切开小数与缩写域名
+_SENTENCE_END_RE = re.compile(r'(?<=[。！？；!?;])(?![”"’」』）)])|(?<=[。！？；!?;][”"’」』）)])|(?<=\.)(?=\s)')
+
+
+def split_sentences(paragraph: str) -> list[str]:
+    return [x for x in _SENTENCE_END_RE.split(paragraph) if x]
+
+
+def _split_to_fit(text: str, tokens: int, token_limit: int, mode: TokenCountMode) -> Iterator[tuple[str, int]]:
+    # 超长段落按句切分, 单句仍超长时按字符比例硬切
+    sentences = split_sentences(text)
+    if len(sentences) > 1:
+        pieces = sentences
+    else:
+        size = max(1, len(text) * token_limit // tokens)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+    for start in range(0, len(pieces), COUNT_BATCH_SIZE):
+        batch = pieces[start:start + COUNT_BATCH_SIZE]
+        for piece, count in zip(batch, count_tokens(batch, mode)):
+            if count > token_limit and len(piece) > 1:
+                yield from _split_to_fit(piece, count, token_limit, mode)
+            else:
+                yield piece, count
+
+
+def _pieces(content: str, token_limit: int, mode: TokenCountMode) -> Iterator[tuple[str, int, str]]:
+    # (文本, token 数, 与前文的连接符): 段落之间用换行, 同一段落切出的句子原样相接
+    lines = [x for x in content.split('\n') if x.strip()]
+    for start in range(0, len(lines), COUNT_BATCH_SIZE):
+        batch = lines[start:start + COUNT_BATCH_SIZE]
+        for line, count in zip(batch, count_tokens(batch, mode)):
+            if count <= token_limit:
+                yield line, count, '\n'
+                continue
+            joiner = '\n'
+            for piece, piece_count in _split_to_fit(line, count, token_limit, mode):
+                yield piece, piece_count, joiner
+                joiner = ''
+
+
+def chunk_text(content: str, token_limit: int, mode=TokenCountMode.EXACT) -> Iterator[str]:
+    # 预算在调用时立即检查: 预算不为正时按字符硬切会把文章拆成逐字的请求
+    if token_limit <= 0:
+        raise ValueError('token_limit must be positive', token_limit)
+    return _pack(content, token_limit, mode)
+
+
+def _pack(content: str, token_limit: int, mode: TokenCountMode) -> Iterator[str]:
+    # 按 token 预算贪心装箱, 每凑满一块立即产出
+    parts = list[str]()
+    used = 0
+    for piece, count, joiner in _pieces(content, token_limit, mode):
+        if parts and used + count > token_limit:
+            yield ''.join(parts)
+            parts, used = [], 0
+        parts.append(joiner + piece if parts else piece)
+        used += count
+    if parts:
+        yield ''.join(parts)
+
+
+async def prefetch_chunks(chunks: Iterator[str]) -> AsyncIterator[str]:
+    # 下一块在线程中准备, 与调用方处理当前块(等待回答)并行
+    loop = asyncio.get_running_loop()
+    pending = loop.run_in_executor(None, next, chunks, None)
+    while (chunk := await pending) is not None:
+        pending = loop.run_in_executor(None, next, chunks, None)
+        yield chunk
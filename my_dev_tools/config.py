@@ -14,8 +14,17 @@ def url_table_data_dir() -> str:
     return os.path.join(DATA_DIR, 'url_manager')
 
 
+def metrics_data_dir() -> str:
+    return os.path.join(DATA_DIR, 'metrics')
+
+
+def article_fixture_dir() -> str:
+    # 保存的文章 HTML, 供 benchmark 评估解析耗时
+    return os.path.join(DATA_DIR, 'article_fixtures')
+
+
 def _init_data_dirs():
-    for path in [DATA_DIR, gpt_prompt_file_dir(), url_table_data_dir()]:
+    for path in [DATA_DIR, gpt_prompt_file_dir(), url_table_data_dir(), metrics_data_dir(), article_fixture_dir()]:
         if not os.path.exists(path):
             os.makedirs(path)
 
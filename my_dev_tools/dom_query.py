@@ -0,0 +1,786 @@
+import abc
+import functools
+import re
+from typing import Any, Callable, Optional, Sequence
+
+
+class XPathError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
+class DomTree(abc.ABC):
+    # 查询引擎只通过这些方法访问节点, 节点本身可以是任意可哈希对象 (如快照中的数组下标)
+
+    @abc.abstractmethod
+    def document(self) -> Any:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def children(self, node) -> Sequence:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def parent(self, node) -> Optional[Any]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def is_element(self, node) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def is_text(self, node) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def local_name(self, node) -> str:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def attributes(self, node) -> dict[str, str]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def node_value(self, node) -> str:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def order(self, node) -> int:
+        raise NotImplementedError
+
+    def text_content(self, node) -> str:
+        if self.is_text(node):
+            return self.node_value(node)
+        return ''.join(self.text_content(x) for x in self.children(node))
+
+
+class _Attr:
+    def __init__(self, owner, name: str, value: str):
+        self.owner = owner
+        self.name = name
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, _Attr) and other.owner == self.owner and other.name == self.name
+
+    def __hash__(self):
+        return hash((self.owner, self.name))
+
+
+_TOKEN_RE = re.compile(r'''
+    \s*(?:
+    (?P<string>"[^"]*"|'[^']*')
+    |(?P<number>\d+(?:\.\d*)?|\.\d+)
+    |(?P<op>//|::|\.\.|!=|<=|>=|[/()\[\]@,|=<>.*])
+    |(?P<name>[A-Za-z_][\w.\-]*(?::[A-Za-z_][\w.\-]*)?)
+    )''', re.VERBOSE)
+
+_AXES = {'child', 'descendant', 'descendant-or-self', 'parent', 'self', 'attribute', 'ancestor',
+         'ancestor-or-self', 'following-sibling', 'preceding-sibling'}
+_REVERSE_AXES = {'parent', 'ancestor', 'ancestor-or-self', 'preceding-sibling'}
+_NODE_TYPES = {'node', 'text'}
+
+
+def _tokenize(expression: str) -> list[tuple[str, str]]:
+    tokens = list()
+    pos = 0
+    expression = expression.strip()
+    while pos < len(expression):
+        m = _TOKEN_RE.match(expression, pos)
+        if not m or m.end() == pos:
+            raise XPathError('Unexpected character', expression, pos)
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+        pos = m.end()
+    return tokens
+
+
+class _Step:
+    def __init__(self, axis: str, test: str, predicates: list):
+        self.axis = axis
+        self.test = test
+        self.predicates = predicates
+
+
+class _Parser:
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+
+    def peek(self, offset=0) -> tuple[str, str]:
+        idx = self.pos + offset
+        return self.tokens[idx] if idx < len(self.tokens) else ('', '')
+
+    def accept(self, value: str) -> bool:
+        if self.peek()[1] == value and self.peek()[0] in ('op', 'name'):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, value: str):
+        if not self.accept(value):
+            raise XPathError(f'Expect "{value}"', self.expression, self.peek()[1])
+
+    def parse(self):
+        expr = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise XPathError('Unexpected token', self.expression, self.peek()[1])
+        return expr
+
+    def _binary(self, sub: Callable, ops: tuple[str, ...]):
+        left = sub()
+        while self.peek()[1] in ops and self.peek()[0] in ('op', 'name'):
+            op = self.peek()[1]
+            self.pos += 1
+            left = ('binary', op, left, sub())
+        return left
+
+    def parse_or(self):
+        return self._binary(self.parse_and, ('or',))
+
+    def parse_and(self):
+        return self._binary(self.parse_equality, ('and',))
+
+    def parse_equality(self):
+        return self._binary(self.parse_relational, ('=', '!='))
+
+    def parse_relational(self):
+        return self._binary(self.parse_union, ('<', '>', '<=', '>='))
+
+    def parse_union(self):
+        return self._binary(self.parse_path, ('|',))
+
+    def parse_path(self):
+        kind, value = self.peek()
+        if kind in ('string', 'number') or value == '(' or (
+                kind == 'name' and self.peek(1)[1] == '(' and value not in _NODE_TYPES):
+            expr = self.parse_filter()
+            steps = self.parse_relative_steps(first_required=False)
+            return ('path', expr, steps) if steps else expr
+        if value == '/':
+            self.pos += 1
+            steps = self.parse_relative_steps(first_required=False, leading=False) \
+                if self._step_start() else []
+            return ('path', ('root',), steps)
+        if value == '//':
+            self.pos += 1
+            steps = [_Step('descendant-or-self', 'node()', [])] + self.parse_relative_steps(leading=False)
+            return ('path', ('root',), steps)
+        return ('path', ('context',), self.parse_relative_steps(leading=False))
+
+    def _step_start(self) -> bool:
+        kind, value = self.peek()
+        return kind == 'name' or value in ('.', '..', '@', '*')
+
+    def parse_relative_steps(self, first_required=True, leading=True) -> list[_Step]:
+        steps = list[_Step]()
+        if not leading:
+            steps.append(self.parse_step())
+        elif first_required:
+            raise XPathError('Expect step', self.expression)
+        while self.peek()[1] in ('/', '//'):
+            if self.peek()[1] == '//':
+                steps.append(_Step('descendant-or-self', 'node()', []))
+            self.pos += 1
+            steps.append(self.parse_step())
+        return steps
+
+    def parse_step(self) -> _Step:
+        if self.accept('..'):
+            return _Step('parent', 'node()', [])
+        if self.accept('.'):
+            return _Step('self', 'node()', [])
+        axis = 'child'
+        if self.accept('@'):
+            axis = 'attribute'
+        elif self.peek()[0] == 'name' and self.peek(1)[1] == '::':
+            axis = self.peek()[1]
+            if axis not in _AXES:
+                raise XPathError('Unsupported axis', self.expression, axis)
+            self.pos += 2
+        kind, value = self.peek()
+        if value == '*':
+            self.pos += 1
+            test = '*'
+        elif kind == 'name':
+            self.pos += 1
+            test = value.lower()
+            if value in _NODE_TYPES and self.peek()[1] == '(':
+                self.pos += 1
+                self.expect(')')
+                test = f'{value}()'
+        else:
+            raise XPathError('Expect node test', self.expression, value)
+        return _Step(axis, test, self.parse_predicates())
+
+    def parse_predicates(self) -> list:
+        predicates = list()
+        while self.accept('['):
+            predicates.append(self.parse_or())
+            self.expect(']')
+        return predicates
+
+    def parse_filter(self):
+        kind, value = self.peek()
+        if kind == 'string':
+            self.pos += 1
+            expr = ('literal', value[1:-1])
+        elif kind == 'number':
+            self.pos += 1
+            expr = ('literal', float(value))
+        elif self.accept('('):
+            expr = self.parse_or()
+            self.expect(')')
+        else:
+            self.pos += 2
+            args = list()
+            if not self.accept(')'):
+                args.append(self.parse_or())
+                while self.accept(','):
+                    args.append(self.parse_or())
+                self.expect(')')
+            expr = ('call', value, args)
+        predicates = self.parse_predicates()
+        return ('filter', expr, predicates) if predicates else expr
+
+
+@functools.lru_cache(maxsize=256)
+def compile_xpath(expression: str):
+    return _Parser(expression).parse()
+
+
+class _Context:
+    def __init__(self, node, position=1, size=1):
+        self.node = node
+        self.position = position
+        self.size = size
+
+
+class _Evaluator:
+    def __init__(self, tree: DomTree):
+        self.tree = tree
+
+    def order_key(self, node):
+        if isinstance(node, _Attr):
+            return self.tree.order(node.owner), 1, node.name
+        return self.tree.order(node), 0, ''
+
+    def sort_unique(self, nodes) -> list:
+        return sorted(set(nodes), key=self.order_key)
+
+    def string_value(self, node) -> str:
+        if isinstance(node, _Attr):
+            return node.value
+        return self.tree.text_content(node)
+
+    def to_string(self, value) -> str:
+        if isinstance(value, list):
+            return self.string_value(value[0]) if value else ''
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, float):
+            return str(int(value)) if value.is_integer() else str(value)
+        return value
+
+    def to_number(self, value) -> float:
+        try:
+            return float(self.to_string(value) if not isinstance(value, (bool, float)) else value)
+        except ValueError:
+            return float('nan')
+
+    @staticmethod
+    def to_bool(value) -> bool:
+        return bool(value)
+
+    def evaluate(self, expr, ctx: _Context):
+        kind = expr[0]
+        if kind == 'literal':
+            return expr[1]
+        if kind == 'root':
+            return [self.tree.document()]
+        if kind == 'context':
+            return [ctx.node]
+        if kind == 'path':
+            nodes = self.evaluate(expr[1], ctx)
+            if not isinstance(nodes, list):
+                raise XPathError('Path on non node-set')
+            for step in expr[2]:
+                nodes = self.apply_step(step, nodes)
+            return nodes
+        if kind == 'filter':
+            nodes = self.evaluate(expr[1], ctx)
+            for predicate in expr[2]:
+                nodes = self.filter(nodes, predicate)
+            return nodes
+        if kind == 'call':
+            return self.call(expr[1], expr[2], ctx)
+        if kind == 'binary':
+            return self.binary(expr[1], expr[2], expr[3], ctx)
+        raise XPathError('Unknown expression', kind)
+
+    def binary(self, op: str, left_expr, right_expr, ctx: _Context):
+        if op == 'or':
+            return self.to_bool(self.evaluate(left_expr, ctx)) or self.to_bool(self.evaluate(right_expr, ctx))
+        if op == 'and':
+            return self.to_bool(self.evaluate(left_expr, ctx)) and self.to_bool(self.evaluate(right_expr, ctx))
+        left, right = self.evaluate(left_expr, ctx), self.evaluate(right_expr, ctx)
+        if op == '|':
+            return self.sort_unique(left + right)
+        return self.compare(op, left, right)
+
+    def compare(self, op: str, left, right) -> bool:
+        if isinstance(left, list):
+            return any(self.compare(op, self.string_value(x), right) for x in left)
+        if isinstance(right, list):
+            return any(self.compare(op, left, self.string_value(x)) for x in right)
+        if op in ('=', '!='):
+            if isinstance(left, bool) or isinstance(right, bool):
+                equal = self.to_bool(left) == self.to_bool(right)
+            elif isinstance(left, float) or isinstance(right, float):
+                equal = self.to_number(left) == self.to_number(right)
+            else:
+                equal = left == right
+            return equal if op == '=' else not equal
+        a, b = self.to_number(left), self.to_number(right)
+        return {'<': a < b, '>': a > b, '<=': a <= b, '>=': a >= b}[op]
+
+    def call(self, name: str, args: list, ctx: _Context):
+        values = [self.evaluate(x, ctx) for x in args]
+        if name == 'last':
+            return float(ctx.size)
+        if name == 'position':
+            return float(ctx.position)
+        if name == 'not':
+            return not self.to_bool(values[0])
+        if name == 'true':
+            return True
+        if name == 'false':
+            return False
+        if name == 'count':
+            return float(len(values[0]))
+        if name == 'contains':
+            return self.to_string(values[1]) in self.to_string(values[0])
+        if name == 'starts-with':
+            return self.to_string(values[0]).startswith(self.to_string(values[1]))
+        if name == 'string':
+            return self.to_string(values[0]) if values else self.string_value(ctx.node)
+        if name == 'normalize-space':
+            text = self.to_string(values[0]) if values else self.string_value(ctx.node)
+            return ' '.join(text.split())
+        if name == 'string-length':
+            return float(len(self.to_string(values[0]) if values else self.string_value(ctx.node)))
+        if name == 'concat':
+            return ''.join(self.to_string(x) for x in values)
+        if name == 'local-name' or name == 'name':
+            nodes = values[0] if values else [ctx.node]
+            if not nodes:
+                return ''
+            return nodes[0].name if isinstance(nodes[0], _Attr) else self.tree.local_name(nodes[0])
+        raise XPathError('Unsupported function', name)
+
+    def filter(self, nodes: list, predicate, reverse=False) -> list:
+        size = len(nodes)
+        result = list()
+        for i, node in enumerate(nodes):
+            position = size - i if reverse else i + 1
+            value = self.evaluate(predicate, _Context(node, position, size))
+            if isinstance(value, float):
+                keep = value == position
+            else:
+                keep = self.to_bool(value)
+            if keep:
+                result.append(node)
+        return result
+
+    def apply_step(self, step: _Step, nodes: list) -> list:
+        result = list()
+        reverse = step.axis in _REVERSE_AXES
+        for node in nodes:
+            candidates = [x for x in self.axis(step.axis, node) if self.node_test(step, x)]
+            if reverse:
+                candidates.sort(key=self.order_key)
+            for predicate in step.predicates:
+                candidates = self.filter(candidates, predicate, reverse)
+            result += candidates
+        if len(nodes) > 1 or reverse:
+            return self.sort_unique(result)
+        return result
+
+    def node_test(self, step: _Step, node) -> bool:
+        test = step.test
+        if test == 'node()':
+            return True
+        if isinstance(node, _Attr):
+            return test == '*' or test == node.name.lower()
+        if test == 'text()':
+            return self.tree.is_text(node)
+        if not self.tree.is_element(node):
+            return False
+        return test == '*' or test == self.tree.local_name(node).lower()
+
+    def axis(self, axis: str, node) -> list:
+        tree = self.tree
+        if isinstance(node, _Attr):
+            if axis in ('parent', 'ancestor', 'ancestor-or-self'):
+                owner_axis = [node.owner] + (self.axis('ancestor', node.owner) if axis != 'parent' else [])
+                return ([node] if axis == 'ancestor-or-self' else []) + owner_axis
+            return [node] if axis in ('self', 'descendant-or-self') else []
+        if axis == 'child':
+            return list(tree.children(node))
+        if axis == 'attribute':
+            if not tree.is_element(node):
+                return []
+            return [_Attr(node, k, v) for k, v in tree.attributes(node).items()]
+        if axis == 'self':
+            return [node]
+        if axis in ('descendant', 'descendant-or-self'):
+            result = [node] if axis == 'descendant-or-self' else []
+            stack = list(reversed(tree.children(node)))
+            while stack:
+                current = stack.pop()
+                result.append(current)
+                stack += reversed(tree.children(current))
+            return result
+        if axis == 'parent':
+            parent = tree.parent(node)
+            return [parent] if parent is not None else []
+        if axis in ('ancestor', 'ancestor-or-self'):
+            result = [node] if axis == 'ancestor-or-self' else []
+            parent = tree.parent(node)
+            while parent is not None:
+                result.append(parent)
+                parent = tree.parent(parent)
+            return result
+        parent = tree.parent(node)
+        if parent is None:
+            return []
+        siblings = list(tree.children(parent))
+        idx = siblings.index(node)
+        if axis == 'following-sibling':
+            return siblings[idx + 1:]
+        return list(reversed(siblings[:idx]))
+
+
+def evaluate_xpath(tree: DomTree, expression: str, context=None) -> list:
+    result = _Evaluator(tree).evaluate(compile_xpath(expression),
+                                       _Context(context if context is not None else tree.document()))
+    if not isinstance(result, list):
+        raise XPathError('Expression is not a node-set', expression)
+    return [x.owner if isinstance(x, _Attr) else x for x in result]
+
+
+class SelectorError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
+_CSS_IDENT_RE = re.compile(r'-?(?:[_a-zA-Z\u00a0-\uffff]|\\.)(?:[-\w\u00a0-\uffff]|\\.)*')
+_CSS_STRING_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\'')
+_CSS_ATTR_OP_RE = re.compile(r'[~|^$*]?=')
+_CSS_NTH_RE = re.compile(r'\s*(?:(?P<odd>odd)|(?P<even>even)|(?P<a>[+-]?\d*)n\s*(?:(?P<sign>[+-])\s*(?P<b>\d+))?'
+                         r'|(?P<index>[+-]?\d+))\s*$', re.IGNORECASE)
+_CSS_SIMPLE_PSEUDO = {'first-child', 'last-child', 'only-child', 'first-of-type', 'last-of-type', 'only-of-type',
+                      'empty', 'root'}
+_CSS_NTH_PSEUDO = {'nth-child', 'nth-last-child', 'nth-of-type', 'nth-last-of-type'}
+_CSS_LIST_PSEUDO = {'not', 'is', 'where'}
+
+
+class _Compound:
+    def __init__(self):
+        self.tag: Optional[str] = None
+        self.conditions = list[tuple]()
+
+
+def _css_unescape(value: str) -> str:
+    return re.sub(r'\\(.)', r'\1', value)
+
+
+def _parse_nth(expression: str) -> tuple[int, int]:
+    m = _CSS_NTH_RE.match(expression)
+    if not m:
+        raise SelectorError('Invalid nth expression', expression)
+    if m.group('odd'):
+        return 2, 1
+    if m.group('even'):
+        return 2, 0
+    if m.group('index'):
+        return 0, int(m.group('index'))
+    a = m.group('a')
+    a = -1 if a == '-' else 1 if a in ('', '+') else int(a)
+    b = int(m.group('b') or 0) * (-1 if m.group('sign') == '-' else 1)
+    return a, b
+
+
+class _CssParser:
+    # 选择器列表 -> [复合选择器链], 链为 [(组合符, _Compound)], 组合符描述与前一个复合选择器的关系
+    def __init__(self, selector: str):
+        self.selector = selector
+        self.pos = 0
+
+    def error(self, message: str):
+        raise SelectorError(message, self.selector, self.pos)
+
+    def peek(self) -> str:
+        return self.selector[self.pos] if self.pos < len(self.selector) else ''
+
+    def skip_space(self) -> bool:
+        start = self.pos
+        while self.peek().isspace():
+            self.pos += 1
+        return self.pos > start
+
+    def expect(self, value: str):
+        if self.peek() != value:
+            self.error(f'Expect "{value}"')
+        self.pos += 1
+
+    def ident(self) -> str:
+        m = _CSS_IDENT_RE.match(self.selector, self.pos)
+        if not m:
+            self.error('Expect identifier')
+        self.pos = m.end()
+        return _css_unescape(m.group())
+
+    def parse(self) -> list:
+        self.skip_space()
+        selectors = self.parse_list()
+        self.skip_space()
+        if self.pos != len(self.selector):
+            self.error('Unexpected character')
+        return selectors
+
+    def parse_list(self) -> list:
+        selectors = [self.parse_complex()]
+        self.skip_space()
+        while self.peek() == ',':
+            self.pos += 1
+            self.skip_space()
+            selectors.append(self.parse_complex())
+            self.skip_space()
+        return selectors
+
+    def parse_complex(self) -> list[tuple[str, _Compound]]:
+        parts = [('', self.parse_compound())]
+        while True:
+            start = self.pos
+            spaced = self.skip_space()
+            c = self.peek()
+            if c in ('>', '+', '~'):
+                self.pos += 1
+                self.skip_space()
+                parts.append((c, self.parse_compound()))
+            elif spaced and c and c not in (',', ')'):
+                parts.append((' ', self.parse_compound()))
+            else:
+                self.pos = start
+                return parts
+
+    def parse_compound(self) -> _Compound:
+        compound = _Compound()
+        if self.peek() == '*':
+            self.pos += 1
+            compound.tag = '*'
+        elif _CSS_IDENT_RE.match(self.selector, self.pos):
+            compound.tag = self.ident().lower()
+        while True:
+            c = self.peek()
+            if c == '#':
+                self.pos += 1
+                compound.conditions.append(('id', self.ident()))
+            elif c == '.':
+                self.pos += 1
+                compound.conditions.append(('class', self.ident()))
+            elif c == '[':
+                self.pos += 1
+                compound.conditions.append(self.parse_attribute())
+            elif c == ':':
+                self.pos += 1
+                compound.conditions.append(self.parse_pseudo())
+            else:
+                break
+        if compound.tag is None and not compound.conditions:
+            self.error('Expect selector')
+        return compound
+
+    def parse_attribute(self) -> tuple:
+        self.skip_space()
+        name = self.ident().lower()
+        self.skip_space()
+        m = _CSS_ATTR_OP_RE.match(self.selector, self.pos)
+        if not m:
+            self.expect(']')
+            return 'attr', name, '', '', False
+        self.pos = m.end()
+        self.skip_space()
+        string = _CSS_STRING_RE.match(self.selector, self.pos)
+        if string:
+            self.pos = string.end()
+            value = _css_unescape(string.group(1) if string.group(1) is not None else string.group(2))
+        else:
+            value = self.ident()
+        self.skip_space()
+        ignore_case = self.peek() in ('i', 'I') and self.peek() != ''
+        if ignore_case:
+            self.pos += 1
+            self.skip_space()
+        self.expect(']')
+        return 'attr', name, m.group(), value, ignore_case
+
+    def parse_pseudo(self) -> tuple:
+        if self.peek() == ':':
+            self.error('Pseudo-elements are not supported')
+        name = self.ident().lower()
+        if name in _CSS_SIMPLE_PSEUDO:
+            return 'pseudo', name, None
+        if name in _CSS_NTH_PSEUDO:
+            self.expect('(')
+            end = self.selector.find(')', self.pos)
+            if end < 0:
+                self.error('Expect ")"')
+            arg = _parse_nth(self.selector[self.pos:end])
+            self.pos = end + 1
+            return 'pseudo', name, arg
+        if name in _CSS_LIST_PSEUDO:
+            self.expect('(')
+            self.skip_space()
+            selectors = self.parse_list()
+            self.skip_space()
+            self.expect(')')
+            return 'pseudo', name, selectors
+        self.error(f'Unsupported pseudo-class :{name}')
+
+
+@functools.lru_cache(maxsize=256)
+def compile_css(selector: str) -> list:
+    return _CssParser(selector).parse()
+
+
+class _CssMatcher:
+    def __init__(self, tree: DomTree):
+        self.tree = tree
+        # 父节点 -> (元素子节点列表, 节点 -> 下标), 一次查询内复用
+        self._siblings = dict()
+
+    def element_parent(self, node) -> Optional[Any]:
+        parent = self.tree.parent(node)
+        return parent if parent is not None and self.tree.is_element(parent) else None
+
+    def siblings(self, node) -> tuple[list, int]:
+        parent = self.tree.parent(node)
+        if parent is None:
+            return [node], 0
+        cached = self._siblings.get(parent)
+        if not cached:
+            elements = [x for x in self.tree.children(parent) if self.tree.is_element(x)]
+            cached = self._siblings[parent] = (elements, {x: i for i, x in enumerate(elements)})
+        return cached[0], cached[1][node]
+
+    def match_list(self, selectors: list, node) -> bool:
+        return any(self.match_complex(x, len(x) - 1, node) for x in selectors)
+
+    def match_complex(self, parts: list, index: int, node) -> bool:
+        combinator, compound = parts[index]
+        if not self.match_compound(compound, node):
+            return False
+        if index == 0:
+            return True
+        if combinator in ('>', ' '):
+            parent = self.element_parent(node)
+            while parent is not None:
+                if self.match_complex(parts, index - 1, parent):
+                    return True
+                if combinator == '>':
+                    return False
+                parent = self.element_parent(parent)
+            return False
+        siblings, position = self.siblings(node)
+        candidates = siblings[position - 1:position] if combinator == '+' else reversed(siblings[:position])
+        return any(self.match_complex(parts, index - 1, x) for x in candidates)
+
+    def match_compound(self, compound: _Compound, node) -> bool:
+        tree = self.tree
+        if not tree.is_element(node):
+            return False
+        if compound.tag not in (None, '*') and tree.local_name(node).lower() != compound.tag:
+            return False
+        attributes = tree.attributes(node) if compound.conditions else None
+        for condition in compound.conditions:
+            kind = condition[0]
+            if kind == 'id':
+                if attributes.get('id') != condition[1]:
+                    return False
+            elif kind == 'class':
+                if condition[1] not in attributes.get('class', '').split():
+                    return False
+            elif kind == 'attr':
+                if not self.match_attribute(attributes, *condition[1:]):
+                    return False
+            elif not self.match_pseudo(node, condition[1], condition[2]):
+                return False
+        return True
+
+    @staticmethod
+    def match_attribute(attributes: dict, name: str, op: str, value: str, ignore_case: bool) -> bool:
+        actual = attributes.get(name)
+        if actual is None:
+            return False
+        if ignore_case:
+            actual, value = actual.lower(), value.lower()
+        if not op:
+            return True
+        if op == '=':
+            return actual == value
+        if op == '~=':
+            return value in actual.split()
+        if op == '|=':
+            return actual == value or actual.startswith(value + '-')
+        if not value:
+            return False
+        if op == '^=':
+            return actual.startswith(value)
+        if op == '$=':
+            return actual.endswith(value)
+        return value in actual
+
+    def match_pseudo(self, node, name: str, arg) -> bool:
+        tree = self.tree
+        if name == 'not':
+            return not self.match_list(arg, node)
+        if name in ('is', 'where'):
+            return self.match_list(arg, node)
+        if name == 'root':
+            return self.element_parent(node) is None
+        if name == 'empty':
+            return not any(tree.is_element(x) or (tree.is_text(x) and tree.node_value(x)) for x in tree.children(node))
+        siblings, position = self.siblings(node)
+        if name.endswith('of-type'):
+            local_name = tree.local_name(node)
+            siblings = [x for x in siblings if tree.local_name(x) == local_name]
+            position = siblings.index(node)
+        if name in ('first-child', 'first-of-type'):
+            return position == 0
+        if name in ('last-child', 'last-of-type'):
+            return position == len(siblings) - 1
+        if name in ('only-child', 'only-of-type'):
+            return len(siblings) == 1
+        a, b = arg
+        index = len(siblings) - position if name.startswith('nth-last') else position + 1
+        if not a:
+            return index == b
+        return (index - b) % a == 0 and (index - b) // a >= 0
+
+
+def select_css(tree: DomTree, selector: str, context=None) -> list:
+    # 与 querySelectorAll 一致: 按文档顺序返回 context 的后代元素, 祖先条件可以匹配到 context 之外
+    selectors = compile_css(selector)
+    matcher = _CssMatcher(tree)
+    root = context if context is not None else tree.document()
+    result = list()
+    stack = list(reversed(tree.children(root)))
+    while stack:
+        node = stack.pop()
+        if matcher.match_list(selectors, node):
+            result.append(node)
+        stack += reversed(tree.children(node))
+    return result
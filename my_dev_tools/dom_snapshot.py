@@ -0,0 +1,164 @@
+from array import array
+from typing import Optional
+
+from .dom_query import DomTree, evaluate_xpath, select_css
+
+ELEMENT_NODE = 1
+TEXT_NODE = 3
+DOCUMENT_NODE = 9
+
+
+class DomSnapshot(DomTree):
+    # DOMSnapshot.captureSnapshot 结果的只读视图: 节点即数组下标, 按文档顺序排列, 查询完全在本地完成
+    def __init__(self, data: dict, document_index=0):
+        self.strings: list[str] = data['strings']
+        document = data['documents'][document_index]
+        nodes = document['nodes']
+        self.url = self._string(document.get('documentURL', -1))
+        self.title = self._string(document.get('title', -1))
+        self._parent: list[int] = nodes['parentIndex']
+        self._type: list[int] = nodes['nodeType']
+        self._name: list[int] = nodes['nodeName']
+        self._value: list[int] = nodes['nodeValue']
+        self._backend: list[int] = nodes['backendNodeId']
+        self._attributes: list[list[int]] = nodes.get('attributes', [])
+        pseudo = set(nodes.get('pseudoType', {}).get('index', []))
+        size = len(self._parent)
+        # 子节点以 first_child/next_sibling 两个数组表示, 伪元素不属于 DOM 树, 不挂到父节点下
+        self._first_child = array('i', [-1]) * size
+        self._next_sibling = array('i', [-1]) * size
+        last_child = array('i', [-1]) * size
+        for i, parent in enumerate(self._parent):
+            if parent < 0 or i in pseudo:
+                continue
+            if last_child[parent] < 0:
+                self._first_child[parent] = i
+            else:
+                self._next_sibling[last_child[parent]] = i
+            last_child[parent] = i
+        self._by_backend: Optional[dict[int, int]] = None
+        self._attribute_cache = dict[int, dict[str, str]]()
+        self._id_counts: Optional[dict[str, int]] = None
+
+    def _string(self, index: int) -> str:
+        return self.strings[index] if index >= 0 else ''
+
+    def __len__(self):
+        return len(self._parent)
+
+    def document(self) -> int:
+        return 0
+
+    def children(self, node: int) -> list[int]:
+        result = list[int]()
+        child = self._first_child[node]
+        while child >= 0:
+            result.append(child)
+            child = self._next_sibling[child]
+        return result
+
+    def parent(self, node: int) -> Optional[int]:
+        parent = self._parent[node]
+        return parent if parent >= 0 else None
+
+    def is_element(self, node: int) -> bool:
+        return self._type[node] == ELEMENT_NODE
+
+    def is_text(self, node: int) -> bool:
+        return self._type[node] == TEXT_NODE
+
+    def local_name(self, node: int) -> str:
+        return self._string(self._name[node]).lower() if self.is_element(node) else ''
+
+    def attributes(self, node: int) -> dict[str, str]:
+        attributes = self._attribute_cache.get(node)
+        if attributes is None:
+            flat = self._attributes[node] if node < len(self._attributes) else []
+            attributes = self._attribute_cache[node] = {self.strings[flat[i]]: self.strings[flat[i + 1]]
+                                                        for i in range(0, len(flat), 2)}
+        return attributes
+
+    def node_value(self, node: int) -> str:
+        return self._string(self._value[node])
+
+    def order(self, node: int) -> int:
+        return node
+
+    def text_content(self, node: int) -> str:
+        if self.is_text(node):
+            return self.node_value(node)
+        texts = list[str]()
+        stack = self.children(node)[::-1]
+        while stack:
+            current = stack.pop()
+            if self.is_text(current):
+                texts.append(self.node_value(current))
+            else:
+                stack += self.children(current)[::-1]
+        return ''.join(texts)
+
+    def backend_id(self, node: int) -> int:
+        return self._backend[node]
+
+    def node_by_backend_id(self, backend_id: int) -> Optional[int]:
+        if self._by_backend is None:
+            self._by_backend = {x: i for i, x in enumerate(self._backend)}
+        return self._by_backend.get(backend_id)
+
+    def query_xpath(self, expression: str, context: Optional[int] = None) -> list[int]:
+        return evaluate_xpath(self, expression, context)
+
+    def query_css(self, selector: str, context: Optional[int] = None) -> list[int]:
+        return select_css(self, selector, context)
+
+    def xpath(self, node: int) -> str:
+        # 按位置生成的绝对路径, 用于把快照节点绑定为 PageNode 后继续做相对查询
+        steps = list[str]()
+        while self.parent(node) is not None:
+            parent = self.parent(node)
+            if self.is_element(node):
+                name = self.local_name(node)
+                same = [x for x in self.children(parent) if self.is_element(x) and self.local_name(x) == name]
+                steps.append(f'{name}[{same.index(node) + 1}]')
+            elif self.is_text(node):
+                same = [x for x in self.children(parent) if self.is_text(x)]
+                steps.append(f'text()[{same.index(node) + 1}]')
+            else:
+                steps.append(f'node()[{self.children(parent).index(node) + 1}]')
+            node = parent
+        return '/' + '/'.join(reversed(steps))
+
+    def css_path(self, node: int) -> str:
+        # 与页面内 CSS 查询返回的路径规则一致: 最近的唯一 id 祖先起逐级 :nth-child
+        if self._id_counts is None:
+            self._id_counts = dict[str, int]()
+            for i in range(len(self)):
+                if self.is_element(i) and self.attributes(i).get('id'):
+                    key = self.attributes(i)['id']
+                    self._id_counts[key] = self._id_counts.get(key, 0) + 1
+        steps = list[str]()
+        while node is not None and self.is_element(node):
+            node_id = self.attributes(node).get('id')
+            if node_id and self._id_counts.get(node_id) == 1:
+                steps.append(f'#{node_id}')
+                break
+            parent = self.parent(node)
+            if parent is not None and self.is_element(parent):
+                elements = [x for x in self.children(parent) if self.is_element(x)]
+                steps.append(f'{self.local_name(node)}:nth-child({elements.index(node) + 1})')
+            else:
+                steps.append(self.local_name(node))
+            node = parent
+        return ' > '.join(reversed(steps))
+
+    def describe(self, node: int) -> dict:
+        # 与 DOM.describeNode 相同的结构, 可直接构造 PageNode
+        return {
+            'backendNodeId': self._backend[node],
+            'nodeType': self._type[node],
+            'nodeName': self._string(self._name[node]),
+            'localName': self.local_name(node),
+            'nodeValue': self.node_value(node),
+            'childNodeCount': len(self.children(node)),
+            'attributes': [x for kv in self.attributes(node).items() for x in kv] if self.is_element(node) else [],
+        }
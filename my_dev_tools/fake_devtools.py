@@ -0,0 +1,797 @@
+import asyncio
+import base64
+import hashlib
+import html
+import json
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional, Self
+from urllib.parse import unquote, urlsplit
+
+from .browser_page import WAIT_FOR_FUNCTION
+from .browser_dom import (ANCESTORS_FUNCTION, CSS_PATHS_FUNCTION, DIRECT_TEXT_FUNCTION, PARENT_NODE_FUNCTION,
+                          RENDERED_TEXT_FUNCTION, SET_ATTRIBUTES_FUNCTION, TEXT_CONTENT_FUNCTION)
+from .dom_query import DomTree, SelectorError, XPathError, evaluate_xpath, select_css
+
+BROWSER_WS_PATH = '/devtools/browser/fake'
+WS_MAGIC = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+BACKEND_ID_OFFSET = 100000
+DEFAULT_DOM_SIZE = 2000
+DEFAULT_DOM_DEPTH = 32
+DEFAULT_EVENT_NOISE_SIZE = 16 * 1024
+CHAT_PARAGRAPHS = 6
+ARTICLE_PARAGRAPHS = 20
+# 页面内 XPath/CSS 查询脚本以 JSON 字符串参数调用: (function (xpath) {...})("//div")
+XPATH_CALL = re.compile(r'\)\(("(?:[^"\\]|\\.)*")\)\s*$')
+# 页面内等待脚本以 JSON 对象参数调用: (function (options) {...})({...})
+OPTIONS_CALL = re.compile(r'\)\((\{.*\})\)\s*$', re.S)
+VOID_ELEMENTS = {'br', 'hr', 'img', 'input', 'meta', 'link'}
+
+
+class FakeNode:
+    def __init__(self, node_id: int, name: str, attrs: Optional[dict] = None, value: str = '',
+                 node_type: int = 1):
+        self.node_id = node_id
+        self.backend_id = node_id + BACKEND_ID_OFFSET
+        self.node_type = node_type
+        self.name = name
+        self.attrs = dict(attrs) if attrs else dict()
+        self.value = value
+        self.children = list[FakeNode]()
+        self.parent: Optional[FakeNode] = None
+        self.order = 0
+
+
+class FakeDom(DomTree):
+    def __init__(self):
+        self._next_id = 0
+        self.nodes = dict[int, FakeNode]()
+        self.root = self._new_node('#document', node_type=9)
+
+    def _new_node(self, name: str, attrs: Optional[dict] = None, value: str = '', node_type=1) -> FakeNode:
+        self._next_id += 1
+        node = FakeNode(self._next_id, name, attrs, value, node_type)
+        self.nodes[node.node_id] = node
+        return node
+
+    def append(self, parent: FakeNode, name: str, attrs: Optional[dict] = None, text: str = '') -> FakeNode:
+        node = self._new_node(name, attrs)
+        node.parent = parent
+        parent.children.append(node)
+        if text:
+            self.append_text(node, text)
+        return node
+
+    def append_text(self, parent: FakeNode, text: str) -> FakeNode:
+        node = self._new_node('#text', value=text, node_type=3)
+        node.parent = parent
+        parent.children.append(node)
+        return node
+
+    def renumber(self):
+        stack = [self.root]
+        order = 0
+        while stack:
+            node = stack.pop()
+            node.order = order
+            order += 1
+            stack += reversed(node.children)
+
+    def by_backend_id(self, backend_id: int) -> Optional[FakeNode]:
+        return self.nodes.get(backend_id - BACKEND_ID_OFFSET)
+
+    def document(self) -> FakeNode:
+        return self.root
+
+    def children(self, node: FakeNode) -> list[FakeNode]:
+        return node.children
+
+    def parent(self, node: FakeNode) -> Optional[FakeNode]:
+        return node.parent
+
+    def is_element(self, node: FakeNode) -> bool:
+        return node.node_type == 1
+
+    def is_text(self, node: FakeNode) -> bool:
+        return node.node_type == 3
+
+    def local_name(self, node: FakeNode) -> str:
+        return node.name if node.node_type == 1 else ''
+
+    def attributes(self, node: FakeNode) -> dict[str, str]:
+        return node.attrs
+
+    def node_value(self, node: FakeNode) -> str:
+        return node.value
+
+    def order(self, node: FakeNode) -> int:
+        return node.order
+
+    def describe(self, node: FakeNode, depth=0) -> dict:
+        data = {
+            'nodeId': node.node_id,
+            'backendNodeId': node.backend_id,
+            'nodeType': node.node_type,
+            'nodeName': node.name.upper() if node.node_type == 1 else node.name,
+            'localName': self.local_name(node),
+            'nodeValue': node.value,
+            'childNodeCount': len(node.children),
+            'attributes': [x for kv in node.attrs.items() for x in kv],
+        }
+        if depth:
+            data['children'] = [self.describe(x, depth - 1) for x in node.children]
+        return data
+
+    def snapshot(self, url: str, title: str) -> dict:
+        # DOMSnapshot.captureSnapshot 的格式: 节点按文档顺序, 字符串统一放在 strings 表中
+        strings = list[str]()
+        string_index = dict[str, int]()
+
+        def _index(value: str) -> int:
+            if value not in string_index:
+                string_index[value] = len(strings)
+                strings.append(value)
+            return string_index[value]
+
+        nodes = {'parentIndex': [], 'nodeType': [], 'nodeName': [], 'nodeValue': [], 'backendNodeId': [],
+                 'attributes': []}
+        stack = [(self.root, -1)]
+        while stack:
+            node, parent_index = stack.pop()
+            index = len(nodes['parentIndex'])
+            nodes['parentIndex'].append(parent_index)
+            nodes['nodeType'].append(node.node_type)
+            nodes['nodeName'].append(_index(node.name.upper() if node.node_type == 1 else node.name))
+            nodes['nodeValue'].append(_index(node.value) if node.value else -1)
+            nodes['backendNodeId'].append(node.backend_id)
+            nodes['attributes'].append([_index(x) for kv in node.attrs.items() for x in kv])
+            stack += [(x, index) for x in reversed(node.children)]
+        return {'documents': [{'documentURL': _index(url), 'title': _index(title), 'nodes': nodes}],
+                'strings': strings}
+
+    def serialize(self, node: FakeNode) -> dict:
+        # Runtime 的 deep 序列化格式, 不含子节点
+        value = {'nodeType': node.node_type, 'childNodeCount': len(node.children), 'backendNodeId': node.backend_id}
+        if node.node_type == 1:
+            value['localName'] = node.name
+            value['attributes'] = dict(node.attrs)
+        else:
+            value['nodeValue'] = node.value
+        return {'type': 'node', 'value': value}
+
+    def css_path(self, node: FakeNode) -> str:
+        # 与 CSS_QUERY_FUNCTION 中的路径规则一致
+        steps = list[str]()
+        while node and node.node_type == 1:
+            node_id = node.attrs.get('id')
+            if node_id and sum(1 for x in self.nodes.values() if x.attrs.get('id') == node_id) == 1:
+                steps.append(f'#{node_id}')
+                break
+            parent = node.parent
+            if parent and parent.node_type == 1:
+                elements = [x for x in parent.children if x.node_type == 1]
+                steps.append(f'{node.name}:nth-child({elements.index(node) + 1})')
+            else:
+                steps.append(node.name)
+            node = parent
+        return ' > '.join(reversed(steps))
+
+    def outer_html(self, node: FakeNode) -> str:
+        if node.node_type == 3:
+            return html.escape(node.value, quote=False)
+        inner = ''.join(self.outer_html(x) for x in node.children)
+        if node.node_type != 1:
+            return inner
+        attrs = ''.join(f' {k}="{html.escape(v)}"' for k, v in node.attrs.items())
+        if node.name in VOID_ELEMENTS:
+            return f'<{node.name}{attrs}>'
+        return f'<{node.name}{attrs}>{inner}</{node.name}>'
+
+
+def build_fake_dom(size=DEFAULT_DOM_SIZE, depth=DEFAULT_DOM_DEPTH, title='Fake page') -> FakeDom:
+    # 模拟 ChatGPT 对话页与公众号文章页的关键结构, 其余部分用普通节点填充到指定规模
+    dom = FakeDom()
+    html_node = dom.append(dom.root, 'html')
+    head = dom.append(html_node, 'head')
+    dom.append(head, 'title', text=title)
+    body = dom.append(html_node, 'body')
+
+    main = dom.append(dom.append(body, 'div', {'id': '__next'}), 'main')
+    for role in ['user', 'assistant']:
+        chat = dom.append(main, 'div', {'class': 'group w-full text-token-text-primary',
+                                        'data-message-author-role': role})
+        for i in range(CHAT_PARAGRAPHS):
+            dom.append(chat, 'p', text=f'{role} paragraph {i}: lorem ipsum dolor sit amet')
+        dom.append(dom.append(chat, 'ul'), 'li', text=f'{role} list item')
+        dom.append(dom.append(chat, 'pre'), 'code', text='print("hello")')
+    dom.append(main, 'textarea', {'id': 'prompt-textarea'})
+
+    dom.append(body, 'h1', {'class': 'rich_media_title'}, text=title)
+    content = dom.append(body, 'div', {'id': 'js_content'})
+    preview = dom.append(dom.append(body, 'div', {'class': 'content-main'}), 'div', {'class': 'article-preview'})
+    for i in range(ARTICLE_PARAGRAPHS):
+        dom.append(dom.append(content, 'section'), 'p', text=f'文章段落 {i}. 这是用于基准测试的正文内容.')
+        dom.append(preview, 'p', text=f'Article paragraph {i}.')
+
+    chain = dom.append(body, 'div', {'id': 'deep', 'data-depth': '0'})
+    for level in range(1, depth):
+        chain = dom.append(chain, 'div', {'data-depth': str(level)})
+    dom.append(chain, 'span', {'class': 'leaf'}, text='leaf')
+
+    filler = dom.append(body, 'div', {'class': 'filler'})
+    row = 0
+    while len(dom.nodes) < size:
+        item = dom.append(filler, 'div', {'class': 'row', 'data-row': str(row)})
+        dom.append(item, 'a', {'href': f'https://example.com/{row}'}, text=f'link {row}')
+        row += 1
+    dom.renumber()
+    return dom
+
+
+class FakeTarget:
+    def __init__(self, server: "FakeDevTools", url: str, title: str):
+        self.id = uuid.uuid4().hex.upper()
+        self.url = url
+        self.title = title
+        self.dom = build_fake_dom(server.dom_size, server.dom_depth, title)
+        self.server = server
+        # handle 产生的事件, 由服务端在响应之后发给同一个 websocket
+        self.events = list[dict]()
+        self._searches = dict[str, list[int]]()
+        # 连到该页面的 websocket 与 sessionId, 页面自身的变化 (mutate) 推送给它们
+        self.peers = list[tuple["_WsPeer", Optional[str]]]()
+        # 正在处理的命令来自哪个连接, 页面内等待的回调发给安装它的连接
+        self.caller: Optional[tuple["_WsPeer", Optional[str]]] = None
+        self._waits = dict[str, _FakeWait]()
+
+    def info(self) -> dict:
+        address = self.server.address
+        return {
+            'description': '',
+            'devtoolsFrontendUrl': f'/devtools/inspector.html?ws={address}/devtools/page/{self.id}',
+            'id': self.id,
+            'title': self.title,
+            'type': 'page',
+            'url': self.url,
+            'webSocketDebuggerUrl': f'ws://{address}/devtools/page/{self.id}',
+        }
+
+    def target_info(self) -> dict:
+        return {'targetId': self.id, 'type': 'page', 'title': self.title, 'url': self.url,
+                'attached': False, 'canAccessOpener': False}
+
+    def send_event(self, caller: tuple["_WsPeer", Optional[str]], method: str, params: dict):
+        peer, session_id = caller
+        event = {'method': method, 'params': params}
+        if session_id:
+            event['sessionId'] = session_id
+        peer.send_later(json.dumps(event), self.server.delay())
+
+    def mutate(self, func: Callable[[FakeDom], Optional[FakeNode]]):
+        # func 修改 DOM 并返回子节点有变化的父节点
+        parent = func(self.dom)
+        self.dom.renumber()
+        if parent:
+            for caller in list(self.peers):
+                self.send_event(caller, 'DOM.childNodeCountUpdated',
+                                {'nodeId': parent.node_id, 'childNodeCount': len(parent.children)})
+        self.check_waits()
+
+    def _wait_nodes(self, wait: "_FakeWait") -> list[FakeNode]:
+        try:
+            if wait.options['kind'] == 'css':
+                return select_css(self.dom, wait.options['query'])
+            return evaluate_xpath(self.dom, wait.options['query'])
+        except (SelectorError, XPathError, IndexError):
+            return []
+
+    def check_waits(self):
+        for wait in list(self._waits.values()):
+            nodes = self._wait_nodes(wait)
+            state = wait.options['state']
+            if state == 'attached' and nodes or state == 'detached' and not nodes:
+                self._finish_wait(wait)
+            elif state == 'text_stable':
+                text = '\n'.join(self.dom.text_content(x) for x in nodes) if nodes else None
+                if text != wait.text:
+                    wait.text = text
+                    if wait.timer:
+                        wait.timer.cancel()
+                    if text is not None:
+                        wait.timer = asyncio.get_running_loop().call_later(wait.options['settle'] / 1000,
+                                                                           self._finish_wait, wait)
+
+    def _finish_wait(self, wait: "_FakeWait"):
+        if self._waits.pop(wait.options['id'], None) is None:
+            return
+        if wait.timer:
+            wait.timer.cancel()
+        if wait.caller:
+            self.send_event(wait.caller, 'Runtime.bindingCalled',
+                            {'name': wait.options['binding'], 'payload': wait.options['id'],
+                             'executionContextId': 1})
+
+    def _node(self, params: dict) -> FakeNode:
+        node = None
+        if params.get('nodeId'):
+            node = self.dom.nodes.get(params['nodeId'])
+        elif params.get('backendNodeId'):
+            node = self.dom.by_backend_id(params['backendNodeId'])
+        elif params.get('objectId', '').startswith('node-'):
+            node = self.dom.by_backend_id(int(params['objectId'][5:]))
+        if not node:
+            raise _CommandError(-32000, 'Could not find node with given id')
+        return node
+
+    def handle(self, method: str, params: dict) -> dict:
+        dom = self.dom
+        if method in ('DOM.enable', 'DOM.disable', 'Page.enable', 'Runtime.enable', 'DOM.focus',
+                      'DOM.scrollIntoViewIfNeeded') or method.startswith('Input.'):
+            return {}
+        if method == 'DOMSnapshot.captureSnapshot':
+            return dom.snapshot(self.url, self.title)
+        if method == 'DOM.getDocument':
+            return {'root': dom.describe(dom.root, params.get('depth', 1))}
+        if method == 'DOM.performSearch':
+            try:
+                nodes = evaluate_xpath(dom, params['query'])
+            except (XPathError, IndexError):
+                nodes = []
+            search_id = uuid.uuid4().hex
+            self._searches[search_id] = [x.node_id for x in nodes]
+            return {'searchId': search_id, 'resultCount': len(nodes)}
+        if method == 'DOM.getSearchResults':
+            node_ids = self._searches.get(params['searchId'])
+            if node_ids is None:
+                raise _CommandError(-32000, 'No search session with given id found')
+            return {'nodeIds': node_ids[params['fromIndex']:params['toIndex']]}
+        if method == 'DOM.discardSearchResults':
+            self._searches.pop(params['searchId'], None)
+            return {}
+        if method in ('DOM.querySelectorAll', 'DOM.querySelector'):
+            try:
+                nodes = select_css(dom, params['selector'], self._node(params))
+            except SelectorError:
+                raise _CommandError(-32000, 'DOM Error while querying')
+            if method == 'DOM.querySelector':
+                return {'nodeId': nodes[0].node_id if nodes else 0}
+            return {'nodeIds': [x.node_id for x in nodes]}
+        if method == 'DOM.describeNode':
+            return {'node': dom.describe(self._node(params), params.get('depth', 0))}
+        if method == 'DOM.getOuterHTML':
+            return {'outerHTML': dom.outer_html(self._node(params))}
+        if method == 'DOM.resolveNode':
+            node = self._node(params)
+            return {'object': {'type': 'object', 'subtype': 'node', 'className': node.name.upper(),
+                               'objectId': f'node-{node.backend_id}'}}
+        if method == 'DOM.pushNodesByBackendIdsToFrontend':
+            return {'nodeIds': [self._node({'backendNodeId': x}).node_id for x in params['backendNodeIds']]}
+        if method == 'DOM.setAttributeValue':
+            self._node(params).attrs[params['name']] = params['value']
+            return {}
+        if method == 'DOM.getContentQuads':
+            order = self._node(params).order
+            return {'quads': [[10, order * 20, 110, order * 20, 110, order * 20 + 18, 10, order * 20 + 18]]}
+        if method == 'Runtime.addBinding':
+            return {}
+        if method == 'Page.navigate':
+            self.url = params['url']
+            # 新文档上的页面内等待都已失效
+            for wait in self._waits.values():
+                if wait.timer:
+                    wait.timer.cancel()
+            self._waits.clear()
+            self.events.append({'method': 'DOM.documentUpdated', 'params': {}})
+            self.events.append({'method': 'Runtime.executionContextCreated',
+                                'params': {'context': {'id': 1, 'origin': self.url, 'name': '',
+                                                       'auxData': {'isDefault': True, 'frameId': self.id}}}})
+            self.server.emit_target_event('Target.targetInfoChanged', {'targetInfo': self.target_info()})
+            return {'frameId': self.id, 'loaderId': uuid.uuid4().hex}
+        if method == 'Runtime.evaluate' and params.get('serializationOptions'):
+            match = XPATH_CALL.search(params['expression'])
+            if match and 'document.querySelectorAll(' in params['expression']:
+                try:
+                    nodes = select_css(dom, json.loads(match.group(1)))
+                except SelectorError as e:
+                    return {'result': {'type': 'object', 'subtype': 'error'},
+                            'exceptionDetails': {'text': 'Uncaught', 'exception': {'description': str(e)}}}
+                pairs = [{'type': 'array', 'value': [dom.serialize(x), {'type': 'string', 'value': dom.css_path(x)}]}
+                         for x in nodes]
+                return {'result': {'type': 'object', 'subtype': 'array',
+                                   'deepSerializedValue': {'type': 'array', 'value': pairs}}}
+            if match and 'document.evaluate(' in params['expression']:
+                try:
+                    nodes = evaluate_xpath(dom, json.loads(match.group(1)))
+                except (XPathError, IndexError) as e:
+                    return {'result': {'type': 'object', 'subtype': 'error'},
+                            'exceptionDetails': {'text': 'Uncaught', 'exception': {'description': str(e)}}}
+                return {'result': {'type': 'object', 'subtype': 'array',
+                                   'deepSerializedValue': {'type': 'array',
+                                                           'value': [dom.serialize(x) for x in nodes]}}}
+        if method in ('Runtime.evaluate', 'Runtime.callFunctionOn'):
+            key = params.get('expression') or params.get('functionDeclaration', '')
+            for prefix, handler in self.server.scripts.items():
+                if key.startswith(prefix):
+                    return handler(self, params)
+            return {'result': {'type': 'undefined'}}
+        raise _CommandError(-32601, f"'{method}' wasn't found")
+
+
+def _css_paths(target: FakeTarget, params: dict) -> dict:
+    paths = [target.dom.css_path(target._node(x)) for x in params['arguments']]
+    return {'result': {'type': 'object', 'subtype': 'array', 'value': paths}}
+
+
+def _set_attributes(target: FakeTarget, params: dict) -> dict:
+    attributes, *nodes = params['arguments']
+    result = list[dict]()
+    for node in [target._node(x) for x in nodes]:
+        for name, value in attributes['value'].items():
+            if value is None:
+                node.attrs.pop(name, None)
+                target.events.append({'method': 'DOM.attributeRemoved',
+                                      'params': {'nodeId': node.node_id, 'name': name}})
+            else:
+                node.attrs[name] = str(value)
+                target.events.append({'method': 'DOM.attributeModified',
+                                      'params': {'nodeId': node.node_id, 'name': name, 'value': str(value)}})
+        result.append(dict(node.attrs))
+    target.check_waits()
+    return {'result': {'type': 'object', 'subtype': 'array', 'value': result}}
+
+
+class _FakeWait:
+    def __init__(self, caller: Optional[tuple["_WsPeer", Optional[str]]], options: dict):
+        self.caller = caller
+        self.options = options
+        self.text: Optional[str] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+def _install_wait(target: FakeTarget, params: dict) -> dict:
+    wait = _FakeWait(target.caller, json.loads(OPTIONS_CALL.search(params['expression']).group(1)))
+    target._waits[wait.options['id']] = wait
+    asyncio.get_running_loop().call_later(wait.options['timeout'] / 1000, target._waits.pop, wait.options['id'], None)
+    target.check_waits()
+    return {'result': {'type': 'undefined'}}
+
+
+def _text_handler(func: Callable[[FakeDom, FakeNode], str]) -> Callable[[FakeTarget, dict], dict]:
+    def _handle(target: FakeTarget, params: dict) -> dict:
+        return {'result': {'type': 'string', 'value': func(target.dom, target._node(params))}}
+
+    return _handle
+
+
+def _ancestors(target: FakeTarget, params: dict) -> dict:
+    chain = list[dict]()
+    node = target._node(params).parent
+    while node and node.node_type == 1:
+        chain.append(target.dom.serialize(node))
+        node = node.parent
+    return {'result': {'type': 'object', 'subtype': 'array',
+                       'deepSerializedValue': {'type': 'array', 'value': chain}}}
+
+
+def _parent_node(target: FakeTarget, params: dict) -> dict:
+    parent = target._node(params).parent
+    if not parent:
+        return {'result': {'type': 'object', 'subtype': 'null', 'value': None}}
+    return {'result': {'type': 'object', 'subtype': 'node', 'className': parent.name.upper(),
+                       'objectId': f'node-{parent.backend_id}'}}
+
+
+class _CommandError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(code, message)
+        self.code = code
+        self.message = message
+
+
+class _WsPeer:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self._send_due = 0.
+
+    async def read_message(self) -> Optional[str]:
+        chunks = list[bytes]()
+        while True:
+            head = await self.reader.readexactly(2)
+            fin, opcode = head[0] & 0x80, head[0] & 0x0f
+            masked, length = head[1] & 0x80, head[1] & 0x7f
+            if length == 126:
+                length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+            mask = await self.reader.readexactly(4) if masked else b''
+            payload = await self.reader.readexactly(length)
+            if mask:
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+            if opcode == 0x8:
+                self.write_frame(0x8, payload[:2])
+                return None
+            if opcode == 0x9:
+                self.write_frame(0xa, payload)
+                continue
+            if opcode == 0xa:
+                continue
+            chunks.append(payload)
+            if fin:
+                return b''.join(chunks).decode('utf-8')
+
+    def write_frame(self, opcode: int, payload: bytes):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        self.writer.write(header + payload)
+
+    def send_later(self, message: str, delay: float):
+        # 保持响应顺序, 但允许多个请求的延迟重叠 (模拟网络往返而非串行处理)
+        loop = asyncio.get_running_loop()
+        due = max(self._send_due, loop.time() + delay)
+        self._send_due = due
+        loop.call_at(due, self.write_frame, 0x1, message.encode('utf-8'))
+
+
+class FakeDevTools:
+    def __init__(self, host='127.0.0.1', port=0, *, latency: float = 0., jitter: float = 0.,
+                 dom_size=DEFAULT_DOM_SIZE, dom_depth=DEFAULT_DOM_DEPTH, event_noise=0,
+                 event_noise_size=DEFAULT_EVENT_NOISE_SIZE):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.dom_size = dom_size
+        self.dom_depth = dom_depth
+        # 每个命令响应前附带的无关事件数 (模拟 console/network 等大事件负载)
+        self.event_noise = event_noise
+        self.event_noise_size = event_noise_size
+        self.targets = dict[str, FakeTarget]()
+        self.scripts = dict[str, Callable[[FakeTarget, dict], dict]]()
+        self.script(TEXT_CONTENT_FUNCTION, _text_handler(lambda dom, node: dom.text_content(node)))
+        self.script(RENDERED_TEXT_FUNCTION, _text_handler(lambda dom, node: dom.text_content(node)))
+        self.script(DIRECT_TEXT_FUNCTION,
+                    _text_handler(lambda dom, node: ''.join(x.value for x in node.children if x.node_type == 3)))
+        self.script(ANCESTORS_FUNCTION, _ancestors)
+        self.script(PARENT_NODE_FUNCTION, _parent_node)
+        self.script(WAIT_FOR_FUNCTION, _install_wait)
+        self.script(SET_ATTRIBUTES_FUNCTION, _set_attributes)
+        self.script(CSS_PATHS_FUNCTION, _css_paths)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.Server] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._discover_peers = list[_WsPeer]()
+
+    @property
+    def address(self) -> str:
+        return f'{self.host}:{self.port}'
+
+    def delay(self) -> float:
+        return max(0., self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def add_target(self, url='about:blank', title='') -> FakeTarget:
+        target = FakeTarget(self, url, title or url)
+        self.targets[target.id] = target
+        self.emit_target_event('Target.targetCreated', {'targetInfo': target.target_info()})
+        return target
+
+    def close_target(self, target_id: str) -> bool:
+        if not self.targets.pop(target_id, None):
+            return False
+        self.emit_target_event('Target.targetDestroyed', {'targetId': target_id})
+        return True
+
+    def mutate(self, target_id: str, func: Callable[[FakeDom], Optional[FakeNode]]):
+        # 模拟页面自身引起的 DOM 变化 (如逐步输出的回答), 可在任意线程调用
+        self._loop.call_soon_threadsafe(self.targets[target_id].mutate, func)
+
+    def emit_target_event(self, method: str, params: dict):
+        if not self._loop:
+            return
+        message = json.dumps({'method': method, 'params': params})
+        for peer in list(self._discover_peers):
+            self._loop.call_soon_threadsafe(peer.send_later, message, self.delay())
+
+    def script(self, prefix: str, handler: Callable[[FakeTarget, dict], dict]):
+        self.scripts[prefix] = handler
+
+    def start(self) -> Self:
+        self._thread = threading.Thread(target=self._run, name='fake-devtools', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def __enter__(self) -> Self:
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._server.close()
+        tasks = asyncio.all_tasks(self._loop)
+        for task in tasks:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self._loop.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = (await reader.readline()).decode('latin-1').strip()
+                if not request_line:
+                    break
+                headers = dict()
+                while (line := (await reader.readline()).decode('latin-1').strip()):
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                method, target, _ = request_line.split(' ', 2)
+                if headers.get('upgrade', '').lower() == 'websocket':
+                    await self._serve_websocket(reader, writer, target, headers)
+                    break
+                await reader.readexactly(int(headers.get('content-length', 0)))
+                await self._serve_http(writer, method, target)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_http(self, writer: asyncio.StreamWriter, method: str, target: str):
+        await asyncio.sleep(self.delay())
+        parts = urlsplit(target)
+        path = parts.path.rstrip('/')
+        status, body = 200, None
+        if path in ('/json', '/json/list'):
+            body = [x.info() for x in self.targets.values()]
+        elif path == '/json/version':
+            body = {'Browser': 'FakeDevTools/1.0', 'Protocol-Version': '1.3',
+                    'webSocketDebuggerUrl': f'ws://{self.address}{BROWSER_WS_PATH}'}
+        elif path == '/json/new':
+            if method != 'PUT':
+                status, body = 405, 'Using unsafe HTTP verb GET to invoke /json/new.'
+            else:
+                body = self.add_target(unquote(parts.query) or 'about:blank').info()
+        elif path.startswith('/json/activate/') or path.startswith('/json/close/'):
+            target_id = path.rsplit('/', 1)[-1]
+            if target_id not in self.targets:
+                status, body = 404, f'No such target id: {target_id}'
+            elif path.startswith('/json/close/'):
+                self.close_target(target_id)
+                body = 'Target is closing'
+            else:
+                body = 'Target activated'
+        else:
+            status, body = 404, f'Unknown url: {path}'
+        raw = (json.dumps(body) if not isinstance(body, str) else body).encode('utf-8')
+        content_type = 'text/plain' if isinstance(body, str) else 'application/json'
+        writer.write(f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\n'
+                     f'Content-Type: {content_type}; charset=UTF-8\r\n'
+                     f'Content-Length: {len(raw)}\r\n\r\n'.encode('latin-1') + raw)
+        await writer.drain()
+
+    async def _serve_websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                               path: str, headers: dict):
+        browser_level = path == BROWSER_WS_PATH
+        target = self.targets.get(path.rsplit('/', 1)[-1])
+        if not browser_level and (not path.startswith('/devtools/page/') or not target):
+            writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+            return
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WS_MAGIC).encode()).digest())
+        writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        peer = _WsPeer(reader, writer)
+        sessions = dict[str, FakeTarget]()
+        if target:
+            target.peers.append((peer, None))
+        while (raw := await peer.read_message()) is not None:
+            request = json.loads(raw)
+            method, params = request['method'], request.get('params', {})
+            response: dict[str, Any] = {'id': request['id']}
+            try:
+                if not browser_level:
+                    target.caller = (peer, None)
+                    response['result'] = target.handle(method, params)
+                elif 'sessionId' in request:
+                    response['sessionId'] = request['sessionId']
+                    session_target = sessions.get(request['sessionId'])
+                    if not session_target or session_target.id not in self.targets:
+                        raise _CommandError(-32001, 'Session with given id not found.')
+                    session_target.caller = (peer, request['sessionId'])
+                    response['result'] = session_target.handle(method, params)
+                else:
+                    response['result'] = self._handle_browser(peer, sessions, method, params)
+            except _CommandError as e:
+                response['error'] = {'code': e.code, 'message': e.message}
+            for _ in range(self.event_noise):
+                peer.send_later(self._noise_event(response.get('sessionId')), self.delay())
+            peer.send_later(json.dumps(response), self.delay())
+            for event_target in [x for x in (target, sessions.get(response.get('sessionId'))) if x and x.events]:
+                for event in event_target.events:
+                    if 'sessionId' in response:
+                        event = dict(event, sessionId=response['sessionId'])
+                    peer.send_later(json.dumps(event), 0)
+                event_target.events.clear()
+        if peer in self._discover_peers:
+            self._discover_peers.remove(peer)
+        for connected in list(self.targets.values()):
+            connected.peers = [x for x in connected.peers if x[0] is not peer]
+
+    def _noise_event(self, session_id: Optional[str]) -> str:
+        event = {'method': 'Runtime.consoleAPICalled',
+                 'params': {'type': 'log', 'args': [{'type': 'string', 'value': 'x' * self.event_noise_size}],
+                            'timestamp': time.time() * 1000}}
+        if session_id:
+            event['sessionId'] = session_id
+        return json.dumps(event)
+
+    def _handle_browser(self, peer: _WsPeer, sessions: dict[str, "FakeTarget"], method: str, params: dict) -> dict:
+        if method == 'Target.attachToTarget':
+            target = self.targets.get(params['targetId'])
+            if not target:
+                raise _CommandError(-32602, 'No target with given id found')
+            session_id = uuid.uuid4().hex.upper()
+            sessions[session_id] = target
+            target.peers.append((peer, session_id))
+            return {'sessionId': session_id}
+        if method == 'Target.detachFromTarget':
+            target = sessions.pop(params.get('sessionId'), None)
+            if not target:
+                raise _CommandError(-32602, 'No session with given id')
+            target.peers = [x for x in target.peers if x[1] != params['sessionId']]
+            return {}
+        if method == 'Target.getTargets':
+            return {'targetInfos': [x.target_info() for x in self.targets.values()]}
+        if method == 'Target.setDiscoverTargets':
+            if params.get('discover'):
+                if peer not in self._discover_peers:
+                    self._discover_peers.append(peer)
+                for target in self.targets.values():
+                    peer.send_later(json.dumps({'method': 'Target.targetCreated',
+                                                'params': {'targetInfo': target.target_info()}}), self.delay())
+            elif peer in self._discover_peers:
+                self._discover_peers.remove(peer)
+            return {}
+        if method == 'Browser.getVersion':
+            return {'product': 'FakeDevTools/1.0', 'protocolVersion': '1.3'}
+        raise _CommandError(-32601, f"'{method}' wasn't found")
+
+
+def main():
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 9100
+    server = FakeDevTools(port=port).start()
+    server.add_target('https://chat.openai.com', 'ChatGPT')
+    print(f'Fake DevTools listening on {server.address}')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
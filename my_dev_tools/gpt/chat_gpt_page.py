@@ -1,4 +1,5 @@
 import asyncio
+import contextlib
 import os
 from typing import Any, Optional, Callable, Coroutine, Sequence
 
@@ -8,11 +9,16 @@ from langchain.prompts import BasePromptTemplate
 from .reader import Article, extract_weixin_article, extract_info_q_article
 from ..browser import Browser, get_browser
 from ..browser_dom import PageNode
-from ..browser_page import BrowserPage, CommandException
+from ..browser_page import BrowserPage, CommandException, DOM_MUTATION_EVENTS
+from ..chunker import CONTEXT_TOKEN_LIMIT, chunk_text, prefetch_chunks
+from ..tokenizer import TokenCountMode, count_tokens
 
 HOME_PAGE = 'https://chat.openai.com'
 FIND_NODE_TIMEOUT = 2
 ANSWER_WAIT_INTERVAL = 1
+ANSWER_SETTLE_INTERVAL = .3
+# 与原 xpath contains(@class, ...) 一致按子串匹配 class, 而不是 .class 的整词匹配
+MESSAGE_SELECTOR = 'div[class*="text-token-text-primary"]'
 
 
 class UnsupportedArticleUrlPrefix(Exception):
@@ -20,15 +26,6 @@ class UnsupportedArticleUrlPrefix(Exception):
         super().__init__(f'Unsupported article url prefix: {prefix}')
 
 
-def _token_size(text: str):
-    if not text:
-        return 0
-    from transformers import AutoTokenizer
-    tokenizer = AutoTokenizer.from_pretrained("bert-base-uncased")
-    tokens = tokenizer.tokenize(text)
-    return len(tokens)
-
-
 class ArticleReader:
     def __init__(self, prefix: str, article_content_func: Callable[[BrowserPage], Coroutine[Any, Any, Article]]):
         self.prefix = prefix
@@ -41,10 +38,12 @@ class GptArticleReadError(Exception):
 
 class ChatGptPage:
 
-    def __init__(self, browser: Optional[Browser] = None):
+    def __init__(self, browser: Optional[Browser] = None, token_mode=TokenCountMode.EXACT):
         if not browser:
             browser = get_browser()
         self.browser = browser
+        # 默认的 token 计数方式, summarize_article 可按次指定
+        self.token_mode = token_mode
         self._page: Optional[BrowserPage] = None
 
     async def ensure_page(self):
@@ -55,18 +54,23 @@ class ChatGptPage:
 
     async def activate(self):
         page = await self.ensure_page()
-        page.activate()
+        await page.activate_async()
 
     async def _query_single_d(self, xpath: str) -> PageNode:
         page = await self.ensure_page()
         return await page.require_single_node_by_xpath(xpath, FIND_NODE_TIMEOUT)
 
+    async def _query_single_css(self, selector: str) -> PageNode:
+        page = await self.ensure_page()
+        return await page.require_single_node_by_css(selector, FIND_NODE_TIMEOUT)
+
     async def new_chat(self):
         page = await self.ensure_page()
         nodes = await page.require_nodes_by_xpath(
             '//div[text()="New chat"]/..//button[contains(@class, "text-token-text-primary")]', FIND_NODE_TIMEOUT)
         await nodes[0].js_click()
-        await page.query_nodes_by_xpath('//div[text()="How can I help you today?"]', FIND_NODE_TIMEOUT)
+        with contextlib.suppress(TimeoutError):
+            await page.wait_for(xpath='//div[text()="How can I help you today?"]', timeout=FIND_NODE_TIMEOUT)
 
     async def ask_as_new_chat(self, ques: str):
         await self.new_chat()
@@ -74,7 +78,7 @@ class ChatGptPage:
 
     async def _ask(self, ques: str):
         node = await self._query_single_d('//*[@id="prompt-textarea"][last()]')
-        await node.submit_input(ques)
+        await node.type_and_submit(ques)
         await node.update_node()
         while (await node.text_content).strip():
             await node.trigger_entry_key()
@@ -85,8 +89,7 @@ class ChatGptPage:
 
     async def continue_ask_and_wait(self, question: str):
         page = await self.ensure_page()
-        messages = await page.query_nodes_by_xpath('//main//div[contains(@class, "text-token-text-primary")]',
-                                                   FIND_NODE_TIMEOUT)
+        messages = await page.query_nodes_by_css(f'main {MESSAGE_SELECTOR}', FIND_NODE_TIMEOUT)
         await self._ask(question)
         await self._wait_answer_done(len(messages))
 
@@ -94,7 +97,7 @@ class ChatGptPage:
         page = await self.ensure_page()
         await self.ask_as_new_chat(prompt.format(**kwargs))
         chats = await self._wait_answer_done()
-        codes = await page.query_nodes_by_xpath(f'{chats[-1].x_path}//code', FIND_NODE_TIMEOUT)
+        codes = await page.query_nodes_by_css(chats[-1].descendant_css('code'), FIND_NODE_TIMEOUT)
         if codes:
             text = ('\n' * 2).join([await x.text_content for x in codes])
         else:
@@ -102,15 +105,17 @@ class ChatGptPage:
         return text
 
     async def _wait_answer_done(self, before_ask_size=0) -> list[PageNode]:
-        main_ele = await self._query_single_d('//div[@id="__next"]//main[1]')
+        main_ele = await self._query_single_css('#__next main:first-of-type')
         page = await self.ensure_page()
         chats = []
-        while (not chats
-               or len(chats) < before_ask_size + 2
-               or not (await self.is_answer_finished(chats[-1]))):
-            chats = await page.query_nodes_by_xpath(
-                f'{main_ele.x_path}//div[contains(@class, "text-token-text-primary")]', FIND_NODE_TIMEOUT)
-            await asyncio.sleep(ANSWER_WAIT_INTERVAL)
+        with page.events.subscribe(*DOM_MUTATION_EVENTS) as mutations:
+            while (not chats
+                   or len(chats) < before_ask_size + 2
+                   or not (await self.is_answer_finished(chats[-1]))):
+                chats = await page.query_nodes_by_css(main_ele.descendant_css(MESSAGE_SELECTOR),
+                                                      FIND_NODE_TIMEOUT)
+                # 回答输出期间 DOM 持续变化, 变化平息后立即检查, 否则最多等待一个间隔
+                await mutations.wait_activity(ANSWER_WAIT_INTERVAL, settle=ANSWER_SETTLE_INTERVAL)
         return chats
 
     async def is_answer_finished(self, chat: PageNode):
@@ -118,9 +123,8 @@ class ChatGptPage:
             return False
         content_nodes = list[PageNode]()
         page = await self.ensure_page()
-        content_nodes += await page.query_nodes_by_xpath(f'{chat.x_path}//p', 0)
-        content_nodes += await page.query_nodes_by_xpath(f'{chat.x_path}//li', 0)
-        content_nodes += await page.query_nodes_by_xpath(f'{chat.x_path}//code', 0)
+        content_nodes += await page.query_nodes_by_css(
+            chat.descendant_css('p', 'li', 'code'), 0, with_pseudo=True)
         if not content_nodes:
             return False
         any_pseudo_text = False
@@ -143,49 +147,49 @@ class ChatGptPage:
             for chat in chats:
                 await chat.js_click()
                 button = await self._query_single_d(f'{history_area.x_path}//button')
-                await button.left_click()
+                await button.click()
                 button = await self._query_single_d('//div[@role="menuitem" and text()="Delete chat"][1]')
                 await button.js_click()
                 button = await self._query_single_d('//div[@role="dialog"]//button[div[text()="Delete"]][1]')
                 await button.js_click()
 
-    async def summarize_article(self, article: Article):
-        content_token = _token_size(article.content)
-        if not content_token:
-            return
+    async def summarize_article(self, article: Article, token_mode: Optional[TokenCountMode] = None):
+        token_mode = token_mode or self.token_mode
         template_dir = os.path.expanduser('~/.my_py_datas/chatgpt/templates')
         instruction_prompt = prompts.load_prompt(os.path.join(template_dir, '文章阅读_指令.json'))
         part_content_prompt = prompts.load_prompt(os.path.join(template_dir, '文章阅读_partContent.json'))
         end_content_prompt = prompts.load_prompt(os.path.join(template_dir, '文章阅读_endContent.json'))
 
-        prompt_token_size = max([_token_size(part_content_prompt.format(content='')),
-                                 _token_size(end_content_prompt.format(caption='', url='', content=''))])
-        token_limit = 4096 - prompt_token_size
+        prompt_token_size = max(count_tokens([part_content_prompt.format(content=''),
+                                              end_content_prompt.format(caption='', url='', content='')],
+                                             token_mode))
+        token_limit = CONTEXT_TOKEN_LIMIT - prompt_token_size
+        chunks = prefetch_chunks(chunk_text(article.content, token_limit, token_mode))
+        # 先取到第一块再开新对话, 空文章不发送指令; 手上始终留一块, 以便最后一块使用结尾模板
+        text = await anext(chunks, None)
+        if text is None:
+            return
         await self.ask_as_new_chat_and_wait(instruction_prompt.format(article_name=article.name))
-        text_len_limit = int(len(article.content) / content_token * token_limit)
-        text = ''
-        for line in article.content.split('\n'):
-            if len(line) > text_len_limit:
-                raise Exception('To long paragraph', f'{line[:20]}...{line[-20:]}')
-            if len(text) + len(line) > 4096:
-                await self.continue_ask_and_wait(part_content_prompt.format(content=text))
-                text = line
-            else:
-                text = '\n'.join([text, line])
-        if text:
-            question = end_content_prompt.format(caption=article.name, url=article.url, content=text)
-            await self.continue_ask_and_wait(question)
+        async for chunk in chunks:
+            await self.continue_ask_and_wait(part_content_prompt.format(content=text))
+            text = chunk
+        question = end_content_prompt.format(caption=article.name, url=article.url, content=text)
+        await self.continue_ask_and_wait(question)
 
     async def _read_all_page_articles(self, readers: Sequence[ArticleReader]):
-        def _next_page_and_reader() -> (BrowserPage, ArticleReader):
+        async def _next_page_and_reader() -> (BrowserPage, ArticleReader):
+            pages = await self.browser.pages_async()
+
+            def _find_page(prefix: str) -> Optional[BrowserPage]:
+                return max(filter(lambda x: x.url.startswith(prefix), pages), default=None, key=lambda x: len(x.url))
+
             return next(filter(lambda t: bool(t[0]),
-                               map(lambda r: (self.browser.find_page_by_url_prefix(r.prefix), r),
-                                   readers)),
+                               map(lambda r: (_find_page(r.prefix), r), readers)),
                         (None, None))
 
         page: BrowserPage
         reader: ArticleReader
-        page, reader = _next_page_and_reader()
+        page, reader = await _next_page_and_reader()
         while page:
             article = await reader.article_content_func(page)
             article.url = page.url
@@ -193,7 +197,7 @@ class ChatGptPage:
                 raise GptArticleReadError(f'Article name or content is empty: {article}')
             await self.summarize_article(article)
             await page.close_and_wait()
-            page, reader = _next_page_and_reader()
+            page, reader = await _next_page_and_reader()
 
     async def read_articles(self):
         readers = [ArticleReader('https://mp.weixin.qq.com/s/', extract_weixin_article),
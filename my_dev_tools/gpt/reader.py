@@ -1,9 +1,8 @@
 import asyncio
 
-from bs4 import BeautifulSoup
-
 from ..browser_dom import PageNode
-from ..browser_page import BrowserPage
+from ..browser_page import BrowserPage, TooMuchNodeError
+from ..html_parse import paragraphs_text
 
 ARTICLE_READ_TIMEOUT = 5
 
@@ -16,26 +15,30 @@ class Article:
 
 
 async def _get_paragraphs_text(node: PageNode, tag_name: str) -> str:
-    root_tag = BeautifulSoup(await node.outer_html, 'html.parser')
-    paragraphs = root_tag.find_all(tag_name)
-    paragraphs = [x.get_text() for x in paragraphs if not x.find_all(tag_name)]
-    return '\n'.join(paragraphs)
+    return paragraphs_text(await node.parsed_html, tag_name)
+
+
+def _single_node(nodes: list[int], query: str) -> int:
+    if len(nodes) > 1:
+        raise TooMuchNodeError(f'query: {query}, len: {len(nodes)}')
+    return nodes[0]
 
 
 async def extract_info_q_article(page: BrowserPage):
-    title_node = await page.require_single_node_by_xpath('(//h1)[1]', ARTICLE_READ_TIMEOUT)
-    content_node = await page.require_single_node_by_xpath(
-        '//*[@class="content-main"]//*[@class="article-preview"][1]', ARTICLE_READ_TIMEOUT)
-    return Article(await title_node.text_content,
+    # 标题与正文节点在同一份快照中查找, 只有取正文 HTML 时才访问页面; class 按整个属性值精确匹配
+    content_xpath = '//*[@class="content-main"]//*[@class="article-preview"][1]'
+    snapshot = await page.require_snapshot([content_xpath], ARTICLE_READ_TIMEOUT, ['h1'])
+    content_node = page.snapshot_node(snapshot, _single_node(snapshot.query_xpath(content_xpath), content_xpath))
+    return Article(snapshot.text_content(snapshot.query_css('h1')[0]),
                    await _get_paragraphs_text(content_node, 'p'))
 
 
 async def extract_weixin_article(page: BrowserPage) -> Article:
-    content_ele = await page.require_single_node_by_xpath('//*[@id="js_content"][1]', ARTICLE_READ_TIMEOUT)
+    snapshot = await page.require_snapshot([], ARTICLE_READ_TIMEOUT, ['h1', '#js_content'])
+    content_ele = page.snapshot_node(snapshot, _single_node(snapshot.query_css('#js_content'), '#js_content'))
     section = await _get_paragraphs_text(content_ele, 'section')
     p = await _get_paragraphs_text(content_ele, 'p')
-    title_node = await page.require_single_node_by_xpath('(//h1)[1]', ARTICLE_READ_TIMEOUT)
-    return Article(await title_node.text_content, p if len(p) > len(section) else section)
+    return Article(snapshot.text_content(snapshot.query_css('h1')[0]), p if len(p) > len(section) else section)
 
 
 def main():
@@ -0,0 +1,65 @@
+import asyncio
+import importlib.util
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from bs4 import BeautifulSoup, Tag
+
+# 超过该大小的 HTML 在工作线程中解析, 避免长文章阻塞 Qt 事件循环
+PARSE_IN_THREAD_SIZE = 64 * 1024
+# BeautifulSoup 的解析器名与其依赖的模块, 按速度从快到慢
+PARSER_MODULES = {'lxml': 'lxml', 'html.parser': None, 'html5lib': 'html5lib'}
+# 各解析器对空白, 隐式标签和不规范标记的处理不同, 文本结果会随之变化;
+# 默认固定为标准库解析器, 需要更快的 lxml 时由调用方显式 set_parser('lxml')
+DEFAULT_PARSER = 'html.parser'
+
+_parser = DEFAULT_PARSER
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+class HtmlParserUnavailable(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
+def available_parsers() -> list[str]:
+    return [name for name, module in PARSER_MODULES.items() if not module or importlib.util.find_spec(module)]
+
+
+def current_parser() -> str:
+    return _parser
+
+
+def set_parser(name: str):
+    if name not in available_parsers():
+        raise HtmlParserUnavailable(name, available_parsers())
+    global _parser
+    _parser = name
+
+
+def parse_html(html: str, parser: Optional[str] = None) -> BeautifulSoup:
+    return BeautifulSoup(html, parser or _parser)
+
+
+def _parse_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if not _executor:
+            _executor = ThreadPoolExecutor(1, thread_name_prefix='html-parse')
+        return _executor
+
+
+async def parse_html_async(html: str, parser: Optional[str] = None) -> BeautifulSoup:
+    parser = parser or _parser
+    if len(html) < PARSE_IN_THREAD_SIZE:
+        return parse_html(html, parser)
+    return await asyncio.get_running_loop().run_in_executor(_parse_executor(), parse_html, html, parser)
+
+
+def paragraphs_text(root_tag: Tag, tag_name: str) -> str:
+    # 只取不再嵌套同名标签的最内层段落
+    paragraphs = root_tag.find_all(tag_name)
+    paragraphs = [x.get_text() for x in paragraphs if not x.find(tag_name)]
+    return '\n'.join(paragraphs)
@@ -0,0 +1,127 @@
+import collections
+import enum
+import hashlib
+import re
+import threading
+from typing import Any, Optional, Sequence
+
+TOKENIZER_NAME = 'bert-base-uncased'
+TOKEN_CACHE_SIZE = 4096
+# 估算模式按 BERT BasicTokenizer 的切分规则计数, 不依赖 transformers:
+# - CJK 字符与标点各计 1 个 token, 与实际切分一致
+# - 字母/数字组成的词: 不超过 ESTIMATE_WHOLE_WORD_CHARS 个字符计 1 个, 更长的每 ESTIMATE_PIECE_CHARS 个字符多计 1 个
+# 误差只来自字母/数字词: 长度 L 的词实际切为 1..L 个 WordPiece, 因此总误差不超过这类字符的总数;
+# 中文为主的文章中这部分占比很小, 实测误差见 benchmark 的 token_count
+ESTIMATE_WHOLE_WORD_CHARS = 7
+ESTIMATE_PIECE_CHARS = 4
+_CJK_RE = re.compile('[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0002ebef\U0002f800-\U0002fa1f]')
+_WORD_RE = re.compile(r'[^\W_]+')
+_PUNCT_RE = re.compile(r'[^\w\s]|_')
+
+
+class TokenCountMode(enum.Enum):
+    EXACT = 'exact'
+    ESTIMATE = 'estimate'
+
+
+def estimate_tokens(text: str) -> int:
+    cjk_count = len(_CJK_RE.findall(text))
+    if cjk_count:
+        text = _CJK_RE.sub(' ', text)
+    words = sum(1 + max(0, len(x) - ESTIMATE_WHOLE_WORD_CHARS + ESTIMATE_PIECE_CHARS - 1) // ESTIMATE_PIECE_CHARS
+                for x in _WORD_RE.findall(text))
+    return cjk_count + words + len(_PUNCT_RE.findall(text))
+
+
+class TokenizerService:
+    # 进程内共享的 tokenizer: 只加载一次, token 数按内容哈希做 LRU 缓存
+    def __init__(self, name: str = TOKENIZER_NAME, cache_size: int = TOKEN_CACHE_SIZE):
+        self.name = name
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._tokenizer: Any = None
+        self._load_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._cache = collections.OrderedDict[bytes, int]()
+        self._warm_thread: Optional[threading.Thread] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._tokenizer is not None
+
+    def _load(self) -> Any:
+        if self._tokenizer is None:
+            with self._load_lock:
+                if self._tokenizer is None:
+                    from transformers import AutoTokenizer
+                    self._tokenizer = AutoTokenizer.from_pretrained(self.name)
+        return self._tokenizer
+
+    def warm_up(self) -> threading.Thread:
+        # 在后台线程加载, 首次计数时不再等待 transformers 导入与词表读取
+        with self._load_lock:
+            if not self._warm_thread:
+                self._warm_thread = threading.Thread(target=self._load, name='tokenizer-warm-up', daemon=True)
+                self._warm_thread.start()
+            return self._warm_thread
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def count_tokens(self, texts: Sequence[str], mode=TokenCountMode.EXACT) -> list[int]:
+        if mode == TokenCountMode.ESTIMATE:
+            return [estimate_tokens(x) for x in texts]
+        counts = [0] * len(texts)
+        missing = dict[bytes, list[int]]()
+        with self._cache_lock:
+            for i, text in enumerate(texts):
+                if not text:
+                    continue
+                key = self._key(text)
+                count = self._cache.get(key)
+                if count is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self._cache.move_to_end(key)
+                    counts[i] = count
+                    self.hits += 1
+        if not missing:
+            return counts
+        # 未命中的文本合并为一次批量编码
+        keys = list(missing)
+        encoded = self._load()([texts[missing[x][0]] for x in keys], add_special_tokens=False,
+                               return_attention_mask=False, return_token_type_ids=False)['input_ids']
+        with self._cache_lock:
+            for key, ids in zip(keys, encoded):
+                for i in missing[key]:
+                    counts[i] = len(ids)
+                self._cache[key] = len(ids)
+                self.misses += 1
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return counts
+
+    def count_token(self, text: str, mode=TokenCountMode.EXACT) -> int:
+        return self.count_tokens([text], mode)[0]
+
+
+_service: Optional[TokenizerService] = None
+_service_lock = threading.Lock()
+
+
+def tokenizer_service() -> TokenizerService:
+    global _service
+    with _service_lock:
+        if not _service:
+            _service = TokenizerService()
+        return _service
+
+
+def count_tokens(texts: Sequence[str], mode=TokenCountMode.EXACT) -> list[int]:
+    return tokenizer_service().count_tokens(texts, mode)
+
+
+def token_size(text: str, mode=TokenCountMode.EXACT) -> int:
+    return tokenizer_service().count_token(text, mode)
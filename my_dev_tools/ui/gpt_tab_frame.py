@@ -14,6 +14,7 @@ from langchain.prompts import load_prompt, PromptTemplate
 from ..config import gpt_prompt_file_dir
 from ..gpt import ChatGptPage
 from ..gpt import parse_template
+from ..tokenizer import TokenCountMode, token_size, tokenizer_service
 
 
 def safe_parse_template(parent: QWidget, template: str) -> Optional[PromptTemplate]:
@@ -37,6 +38,9 @@ class GptTabFrame(QFrame):
     def __init__(self, parent: Optional[QWidget] = None):
         super().__init__(parent)
         self.chat_page = ChatGptPage()
+        # 读文章时才会用到 tokenizer, 启动时在后台预先加载
+        if self.chat_page.token_mode == TokenCountMode.EXACT:
+            tokenizer_service().warm_up()
 
         from ..ui.gpt_tab_frame_uic import Ui_GptTabFrame
         self.ui = Ui_GptTabFrame()
@@ -120,7 +124,8 @@ class GptTabFrame(QFrame):
     @Slot()
     def update_for_template_change(self):
         template = self.template_edit_widget.toPlainText()
-        self.statusLabelTextReset.emit('模板被修改')
+        # 每次输入都会触发, 只用估算模式
+        self.statusLabelTextReset.emit(f'模板被修改, 约 {token_size(template, TokenCountMode.ESTIMATE)} tokens')
         self.update_variable_form(template)
 
     def update_variable_form(self, template: str):